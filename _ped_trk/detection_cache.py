@@ -0,0 +1,349 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import cv2
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Entries in use aren't protected from eviction by other processes, where file locks are unavailable
+    fcntl = None
+
+import _ped_trk.metrics
+import _ped_trk.timer
+
+
+def hash_video(path, chunk_size=1 << 20):
+    """
+    Fingerprints a video or an image sequence by sizes, modification times and inodes of its files, a number of frames
+    and a duration of the stream, and contents of the head and the tail, so hashing doesn't cost a pass over the whole
+    video, while re-encoding or editing it in place changes the fingerprint
+    """
+    digest = hashlib.sha256()
+    file_paths = sorted(os.path.join(path, n) for n in os.listdir(path)) if os.path.isdir(path) else [path, ]
+    for file_path in file_paths:
+        st = os.stat(file_path)
+        digest.update(f'{os.path.basename(file_path)}:{st.st_size}:{st.st_mtime_ns}:{st.st_ino};'.encode())
+
+    if not os.path.isdir(path):
+        capture = cv2.VideoCapture(filename=path)
+        frames_num, fps = capture.get(cv2.CAP_PROP_FRAME_COUNT), capture.get(cv2.CAP_PROP_FPS)
+        capture.release()
+        digest.update(f'{frames_num}:{frames_num / fps if fps else 0.};'.encode())
+
+    for file_path in {file_paths[0], file_paths[-1]}:
+        with open(file=file_path, mode='rb') as fp:
+            digest.update(fp.read(chunk_size))
+            fp.seek(max(0, os.path.getsize(file_path) - chunk_size))
+            digest.update(fp.read(chunk_size))
+
+    return digest.hexdigest()
+
+
+def hash_settings(settings):
+    """
+    """
+    return hashlib.sha256(json.dumps(obj=settings, sort_keys=True).encode()).hexdigest()
+
+
+class DetectionCache(_ped_trk.timer.Timeable):
+    """
+    Wraps a detector to keep its detections on disk per video, frame and detector settings, so reruns don't infer
+    the same frames again. Stored detections are memory-mapped, so a hit costs a lookup only.
+    New detections are merged into the entry once the run is over
+    """
+    # Columns of stored frames and boxes
+    _FRAME_COLUMNS = ('frame_id', 'roi_l', 'roi_t', 'roi_w', 'roi_h', 'offset', 'count')
+    _BOX_COLUMNS = ('l', 't', 'w', 'h', 'score')
+    _FRAMES_FILE_NAME = 'frames.npy'
+    _BOXES_FILE_NAME = 'boxes.npy'
+
+    def __init__(self, logger, detector, folder_path, key, roi_sensitive, max_bytes):
+        """
+        """
+        super().__init__(logger=logger)
+
+        self.__detector = detector
+        self.__folder_path = os.path.abspath(folder_path)
+        self.__entry_path = os.path.join(self.__folder_path, key)
+        self.__roi_sensitive = roi_sensitive
+        self.__max_bytes = max_bytes
+
+        self.__frame_ids = []
+        self.__new_per_key = {}
+        self.__hits_num = 0
+        self.__misses_num = 0
+        self.__lock_file = self.__acquire()
+        self.__load()
+
+    def __acquire(self):
+        """
+        Holds a shared lock of the entry while it's open, so other processes, e.g. batch workers, don't evict it
+        """
+        if fcntl is None:
+            return None
+
+        lock_file = open(file=f'{self.__entry_path}.lock', mode='a')
+        fcntl.flock(lock_file, fcntl.LOCK_SH)
+        return lock_file
+
+    def __load(self):
+        """
+        Maps a stored entry, if there is one
+        """
+        self.__frames, self.__boxes, self.__location_per_key = None, None, {}
+        frames_path = os.path.join(self.__entry_path, self._FRAMES_FILE_NAME)
+        if os.path.exists(frames_path):
+            self.__frames = np.load(file=frames_path, mmap_mode='r')
+            self.__boxes = np.load(file=os.path.join(self.__entry_path, self._BOXES_FILE_NAME), mmap_mode='r')
+            for frame_id, *roi, offset, count in self.__frames.tolist():
+                self.__location_per_key[(frame_id, tuple(roi))] = offset, count
+            # Mark the entry as recently used for eviction
+            os.utime(path=self.__entry_path)
+
+        self.get_logger().info(f'Open a detection cache: {{'
+                               f'"path": "{self.__entry_path}", '
+                               f'"frames_num": {len(self.__location_per_key)}, '
+                               f'"max_bytes": {self.__max_bytes}'
+                               f'}}')
+
+    def __get_key(self, frame_id, roi, frame):
+        """
+        Keys detections by a frame and a ROI, any ROI covering the whole frame is the same as none, e.g. the one
+        trackers settle for a frame without a given ROI
+        """
+        if not self.__roi_sensitive or roi is None:
+            return frame_id, (-1, -1, -1, -1)
+
+        frame_h, frame_w = frame.shape[:2]
+        l, t, w, h = roi
+        if l <= 0 and t <= 0 and frame_w - 1 <= l + w and frame_h - 1 <= t + h:
+            return frame_id, (-1, -1, -1, -1)
+
+        return frame_id, tuple(roi)
+
+    def __lookup(self, key):
+        """
+        Returns cached detections or None
+        """
+        if key in self.__new_per_key:
+            rows = self.__new_per_key[key]
+        elif key in self.__location_per_key:
+            offset, count = self.__location_per_key[key]
+            rows = self.__boxes[offset:offset + count]
+        else:
+            return None
+
+        return [{'lt_wh': tuple(int(v) for v in row[:4]), 'score': float(row[4])} for row in np.asarray(rows).tolist()]
+
+    def __remember(self, key, detections):
+        """
+        """
+        self.__new_per_key[key] = np.array([tuple(d['lt_wh']) + (d['score'],) for d in detections],
+                                           dtype=np.float64).reshape(-1, len(self._BOX_COLUMNS))
+
+    def set_frame_ids(self, frame_ids):
+        """
+        Tells ids of frames the next detection is run for, in the order of the frames
+        """
+        self.__frame_ids = list(frame_ids)
+
+    def detect(self, frame, roi=None):
+        """
+        """
+        (frame_id,) = self.__frame_ids
+        [detections, ] = self.__detect(frame_ids=[frame_id, ], frames=[frame, ], roi=roi, batched=False)
+        return detections
+
+    def defer(self, frame):
+        """
+        Binds detection at a frame to the id of the frame, so the detection may run later, e.g. at a worker
+        """
+        (frame_id,) = self.__frame_ids
+        return lambda roi=None: self.__detect(frame_ids=[frame_id, ], frames=[frame, ], roi=roi, batched=False)[0]
+
+    def detect_batch(self, frames, roi=None):
+        """
+        """
+        return self.__detect(frame_ids=self.__frame_ids, frames=frames, roi=roi, batched=True)
+
+    def __detect(self, frame_ids, frames, roi, batched):
+        """
+        Serves known frames from the cache and detects objects at the rest
+        """
+        if len(frame_ids) != len(frames):
+            raise ValueError(f'Frame ids don\'t match frames: {len(frame_ids)} vs {len(frames)}')
+
+        keys = [self.__get_key(frame_id=frame_id, roi=roi, frame=frame) for frame_id, frame in zip(frame_ids, frames)]
+        detections_per_frame = [self.__lookup(key=key) for key in keys]
+        missed = [i for i, detections in enumerate(detections_per_frame) if detections is None]
+
+        if missed:
+            missed_frames = [frames[i] for i in missed]
+            if batched:
+                missed_detections = self.__detector.detect_batch(frames=missed_frames, roi=roi)
+            else:
+                missed_detections = [self.__detector.detect(frame=missed_frames[0], roi=roi), ]
+            for i, detections in zip(missed, missed_detections):
+                self.__remember(key=keys[i], detections=detections)
+                detections_per_frame[i] = detections
+
+        hits_num = len(frames) - len(missed)
+        self.__hits_num += hits_num
+        self.__misses_num += len(missed)
+        registry = _ped_trk.metrics.get_registry()
+        registry.increment(label='detection_cache_hits', num=hits_num)
+        registry.increment(label='detection_cache_misses', num=len(missed))
+
+        return detections_per_frame
+
+    def __store(self):
+        """
+        Merges new detections into the entry, files are replaced atomically
+        """
+        frames, boxes = [], []
+        offset = 0
+        for key, (old_offset, count) in self.__location_per_key.items():
+            if key in self.__new_per_key:
+                continue
+            frames.append(key[:1] + key[1] + (offset, count))
+            boxes.append(self.__boxes[old_offset:old_offset + count])
+            offset += count
+        for key, rows in self.__new_per_key.items():
+            frames.append(key[:1] + key[1] + (offset, len(rows)))
+            boxes.append(rows)
+            offset += len(rows)
+
+        frames = np.array(frames, dtype=np.int64).reshape(-1, len(self._FRAME_COLUMNS))
+        boxes = np.concatenate(boxes).astype(np.float64) if boxes else np.empty(shape=(0, len(self._BOX_COLUMNS)))
+
+        # Release the maps before the files are replaced
+        self.__frames, self.__boxes, self.__location_per_key = None, None, {}
+
+        os.makedirs(name=self.__entry_path, exist_ok=True)
+        for file_name, array in ((self._BOXES_FILE_NAME, boxes), (self._FRAMES_FILE_NAME, frames)):
+            path = os.path.join(self.__entry_path, file_name)
+            with open(file=f'{path}.tmp', mode='wb') as fp:
+                np.save(file=fp, arr=array)
+            os.replace(f'{path}.tmp', path)
+
+        return len(frames)
+
+    def __evict(self):
+        """
+        Removes the least recently used entries, until the cache fits the size limit
+        """
+        entries = []
+        for name in os.listdir(self.__folder_path):
+            path = os.path.join(self.__folder_path, name)
+            if os.path.isdir(path):
+                size = sum(os.path.getsize(os.path.join(path, n)) for n in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.__max_bytes or path == self.__entry_path:
+                continue
+            if not self.__remove(path=path):
+                self.get_logger().debug(f'Keep a detection cache entry in use at {path}')
+                continue
+
+            total_bytes -= size
+            self.get_logger().info(f'Evict a detection cache entry: {{'
+                                   f'"path": "{path}", '
+                                   f'"bytes": {size}'
+                                   f'}}')
+
+    @staticmethod
+    def __remove(path):
+        """
+        Removes an entry, unless some process holds it open. Returns whether it's removed
+        """
+        if fcntl is None:
+            shutil.rmtree(path=path, ignore_errors=True)
+            return True
+
+        with open(file=f'{path}.lock', mode='a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            shutil.rmtree(path=path, ignore_errors=True)
+
+        return True
+
+    def invalidate(self):
+        """
+        Forgets detections of the entry
+        """
+        self.__frames, self.__boxes, self.__location_per_key = None, None, {}
+        self.__new_per_key = {}
+        shutil.rmtree(path=self.__entry_path, ignore_errors=True)
+        self.get_logger().info(f'Invalidate a detection cache entry at {self.__entry_path}')
+
+    def close(self):
+        """
+        Stores new detections and keeps the cache within the size limit
+        """
+        frames_num = len(self.__location_per_key)
+        if self.__new_per_key:
+            frames_num = self.__store()
+            self.__new_per_key = {}
+            # Map the stored entry again, so the cache stays usable
+            self.__load()
+        self.__evict()
+        if self.__lock_file is not None:
+            self.__lock_file.close()
+            self.__lock_file = None
+
+        self.get_logger().info(f'Close a detection cache: {{'
+                               f'"path": "{self.__entry_path}", '
+                               f'"hits_num": {self.__hits_num}, '
+                               f'"misses_num": {self.__misses_num}, '
+                               f'"frames_num": {frames_num}'
+                               f'}}')
+
+
+def purge(logger, folder_path):
+    """
+    Removes all the entries of a cache
+    """
+    shutil.rmtree(path=folder_path, ignore_errors=True)
+    logger.info(f'Purge a detection cache at {os.path.abspath(folder_path)}')
+
+
+def create_detection_cache(logger, args, settings, detector):
+    """
+    Wraps a detector with a cache, if it's requested, otherwise returns None
+    """
+    folder_path = args['detection_cache']
+    if folder_path is None:
+        return None
+
+    os.makedirs(name=folder_path, exist_ok=True)
+
+    start = time.perf_counter()
+    video_hash = hash_video(path=args['video_path'])
+    # Decoding at another scale changes frames, and the ROI matters only if detectors crop by it.
+    # Warming up doesn't change detections
+    detector_settings = {k: v for k, v in settings['detector'].items() if 'warm_up' != k}
+    settings_hash = hash_settings(settings={'detector': detector_settings, 'decode_scale': args['decode_scale'],
+                                            'strategy': args['strategy']})
+    logger.debug(f'Hash a video for the detection cache: {{'
+                 f'"video_path": "{args["video_path"]}", '
+                 f'"hash": "{video_hash}", '
+                 f'"elapsed_s": {time.perf_counter() - start:.3f}'
+                 f'}}')
+
+    cache = DetectionCache(logger=logger, detector=detector, folder_path=folder_path,
+                           key=f'{video_hash[:16]}_{settings_hash[:16]}',
+                           roi_sensitive='pm' != args['strategy'] or settings['detector']['roi_crop'],
+                           max_bytes=args['detection_cache_max_bytes'])
+    if 'entry' == args['detection_cache_invalidate']:
+        cache.invalidate()
+
+    return cache
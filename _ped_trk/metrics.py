@@ -0,0 +1,195 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+
+class Histogram:
+    """
+    Counts latencies in fixed, geometrically growing buckets, so percentiles cost no samples to keep
+    """
+    # Bucket bounds span 1us..~100s with ~19% relative error
+    _BOUNDS_NS = [int(1e3 * 2 ** (i / 4)) for i in range(107)]
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__counts = [0, ] * (len(self._BOUNDS_NS) + 1)
+        self.__num = 0
+        self.__total_ns = 0
+        self.__min_ns = None
+        self.__max_ns = None
+
+    def record(self, ns):
+        """
+        """
+        i = bisect.bisect_left(self._BOUNDS_NS, ns)
+        with self.__lock:
+            self.__counts[i] += 1
+            self.__num += 1
+            self.__total_ns += ns
+            if self.__min_ns is None or ns < self.__min_ns:
+                self.__min_ns = ns
+            if self.__max_ns is None or self.__max_ns < ns:
+                self.__max_ns = ns
+
+    def __get_percentile_ns(self, q):
+        """
+        Returns an upper bound of a bucket holding the percentile, clamped by the observed extremes
+        """
+        rank = q * self.__num
+        cumulative = 0
+        for i, count in enumerate(self.__counts):
+            cumulative += count
+            if rank <= cumulative and count:
+                bound = self._BOUNDS_NS[i] if i < len(self._BOUNDS_NS) else self.__max_ns
+                return min(max(bound, self.__min_ns), self.__max_ns)
+
+        return self.__max_ns
+
+    def get_summary(self):
+        """
+        Returns stats in milliseconds
+        """
+        with self.__lock:
+            if not self.__num:
+                return {'num': 0}
+
+            to_ms = lambda ns: round(ns / 1e6, 3)
+            return {
+                'num': self.__num,
+                'total': to_ms(self.__total_ns),
+                'mean': to_ms(self.__total_ns / self.__num),
+                'min': to_ms(self.__min_ns),
+                'p50': to_ms(self.__get_percentile_ns(q=.5)),
+                'p95': to_ms(self.__get_percentile_ns(q=.95)),
+                'p99': to_ms(self.__get_percentile_ns(q=.99)),
+                'max': to_ms(self.__max_ns)
+            }
+
+
+class Registry:
+    """
+    Keeps counters and latency histograms per label in process
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__enabled = False
+        self.__histograms = {}
+        self.__counters = {}
+        self.__started_at = time.perf_counter()
+
+        self.__dump_path = None
+        self.__dump_stopped = None
+        self.__dumper = None
+
+    def enable(self, enabled=True):
+        """
+        """
+        self.__enabled = enabled
+
+    def is_enabled(self):
+        """
+        """
+        return self.__enabled
+
+    def reset(self):
+        """
+        Forgets everything recorded so far
+        """
+        with self.__lock:
+            self.__histograms = {}
+            self.__counters = {}
+            self.__started_at = time.perf_counter()
+
+    def record(self, label, ns):
+        """
+        Records a latency of an operation
+        """
+        if not self.__enabled:
+            return
+
+        histogram = self.__histograms.get(label)
+        if histogram is None:
+            with self.__lock:
+                histogram = self.__histograms.setdefault(label, Histogram())
+        histogram.record(ns=ns)
+
+    def increment(self, label, num=1):
+        """
+        """
+        if not self.__enabled:
+            return
+
+        with self.__lock:
+            self.__counters[label] = self.__counters.get(label, 0) + num
+
+    def get_summary(self):
+        """
+        """
+        with self.__lock:
+            histograms = dict(self.__histograms)
+            counters = dict(self.__counters)
+            elapsed_s = time.perf_counter() - self.__started_at
+
+        return {
+            'elapsed_s': round(elapsed_s, 3),
+            'counters': counters,
+            'latencies_ms': {label: histograms[label].get_summary() for label in sorted(histograms)}
+        }
+
+    def dump(self, path):
+        """
+        Stores the summary as JSON, the file is replaced atomically to be safe to read at any moment
+        """
+        summary = self.get_summary()
+        tmp_path = f'{path}.tmp'
+        with open(file=tmp_path, mode='w') as fp:
+            json.dump(obj=summary, fp=fp, indent=2)
+        os.replace(tmp_path, path)
+
+        return summary
+
+    def __dump_periodically(self, period_s):
+        """
+        """
+        while not self.__dump_stopped.wait(timeout=period_s):
+            self.dump(path=self.__dump_path)
+
+    def start_dumping(self, path, period_s):
+        """
+        Dumps the summary every period to a file, a non-positive period leaves the end-of-run dump only
+        """
+        self.__dump_path = path
+        self.__dump_stopped = threading.Event()
+        if 0 < period_s:
+            self.__dumper = threading.Thread(target=self.__dump_periodically, args=(period_s,), name='MetricsDumper',
+                                             daemon=True)
+            self.__dumper.start()
+
+    def stop_dumping(self):
+        """
+        Stops periodic dumps and makes the end-of-run one, returns its summary
+        """
+        if self.__dump_path is None:
+            return self.get_summary()
+
+        self.__dump_stopped.set()
+        if self.__dumper is not None:
+            self.__dumper.join()
+            self.__dumper = None
+
+        summary = self.dump(path=self.__dump_path)
+        self.__dump_path = None
+        return summary
+
+
+_REGISTRY = Registry()
+
+
+def get_registry():
+    """
+    Returns the registry of the process
+    """
+    return _REGISTRY
@@ -0,0 +1,131 @@
+import cv2
+import numpy as np
+
+import _ped_trk.timer
+
+
+class MotionGate(_ped_trk.timer.Timeable):
+    """
+    Tells cheaply where anything moved since the last detection, differencing downscaled grayscale frames.
+    Frames, no pixel of which differs from the previous frame by more than the frozen threshold, are recognised as
+    frozen, e.g. repeated by a stalled stream. Any local motion keeps a frame live, however small the moved region is
+    """
+
+    def __init__(self, logger, scale, threshold, min_area, frozen_threshold):
+        """
+        """
+        super().__init__(logger=logger)
+
+        if not 0 < scale <= 1:
+            raise ValueError(f'Motion scale must be within (0, 1], got {scale}')
+
+        self.__scale = scale
+        self.__threshold = threshold
+        self.__min_area = min_area
+        self.__frozen_threshold = frozen_threshold
+        self.get_logger().info(f'Establish a motion gate: {{'
+                               f'"scale": {scale}, '
+                               f'"threshold": {threshold}, '
+                               f'"min_area": {min_area}, '
+                               f'"frozen_threshold": {frozen_threshold}'
+                               f'}}')
+
+        self.__previous = None
+        # Pixels changed since the last detection
+        self.__motion = None
+        self.__frame_size = None
+
+    @_ped_trk.timer.timer(label='motion_gating')
+    def update(self, frame):
+        """
+        Accumulates motion at a frame, returns True, if the frame is frozen
+        """
+        small = cv2.resize(src=frame, dsize=None, fx=self.__scale, fy=self.__scale, interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(src=cv2.cvtColor(src=small, code=cv2.COLOR_BGR2GRAY), ksize=(3, 3), sigmaX=0)
+
+        if self.__previous is None or self.__previous.shape != gray.shape:
+            # Nothing is known about the scene, so everything counts as moved
+            self.__previous = gray
+            self.__motion = np.full(shape=gray.shape, fill_value=255, dtype=np.uint8)
+            self.__frame_size = frame.shape[1::-1]
+            return False
+
+        diff = cv2.absdiff(src1=gray, src2=self.__previous)
+        _, max_diff, _, _ = cv2.minMaxLoc(src=diff)
+        if max_diff <= self.__frozen_threshold:
+            return True
+
+        self.__previous = gray
+        _, moved = cv2.threshold(src=diff, thresh=self.__threshold, maxval=255, type=cv2.THRESH_BINARY)
+        cv2.bitwise_or(src1=self.__motion, src2=moved, dst=self.__motion)
+        return False
+
+    def get_regions(self, roi):
+        """
+        Returns bounding rects of regions moved since the last detection within a ROI in frame coordinates
+        """
+        if self.__motion is None:
+            return []
+
+        motion_h, motion_w = self.__motion.shape
+        l, t, w, h = roi
+        s_l, s_t = max(int(l * self.__scale), 0), max(int(t * self.__scale), 0)
+        s_r = min(int(np.ceil((l + w) * self.__scale)), motion_w)
+        s_b = min(int(np.ceil((t + h) * self.__scale)), motion_h)
+        if s_r <= s_l or s_b <= s_t:
+            return []
+
+        # Merge nearby changes of a single object
+        moved = cv2.dilate(src=self.__motion[s_t:s_b, s_l:s_r], kernel=np.ones(shape=(3, 3), dtype=np.uint8))
+        num, _, stats, _ = cv2.connectedComponentsWithStats(image=moved, connectivity=8)
+
+        frame_w, frame_h = self.__frame_size
+        regions = []
+        for r_l, r_t, r_w, r_h, area in stats[1:num].tolist():
+            if area < self.__min_area:
+                continue
+
+            # Map a region back to the frame coordinates, rounding outwards
+            f_l, f_t = int((s_l + r_l) / self.__scale), int((s_t + r_t) / self.__scale)
+            f_r = min(int(np.ceil((s_l + r_l + r_w) / self.__scale)), frame_w)
+            f_b = min(int(np.ceil((s_t + r_t + r_h) / self.__scale)), frame_h)
+            regions.append((f_l, f_t, f_r - f_l, f_b - f_t))
+
+        return regions
+
+    def clear(self):
+        """
+        Forgets the motion accumulated so far, e.g. once objects are detected
+        """
+        if self.__motion is not None:
+            self.__motion[:] = 0
+
+
+def bound(rects, roi):
+    """
+    Returns a rect bounding all the rects, clipped by a ROI, or None, if there are no rects
+    """
+    if not rects:
+        return None
+
+    rects = np.asarray(rects).reshape(-1, 4)
+    l, t = rects[:, :2].min(axis=0).tolist()
+    r, b = (rects[:, :2] + rects[:, 2:]).max(axis=0).tolist()
+
+    roi_l, roi_t, roi_w, roi_h = roi
+    l, t = max(l, roi_l), max(t, roi_t)
+    r, b = min(r, roi_l + roi_w), min(b, roi_t + roi_h)
+    if r <= l or b <= t:
+        return None
+
+    return l, t, r - l, b - t
+
+
+def create_motion_gate(logger, settings):
+    """
+    """
+    if not settings['enabled']:
+        return None
+
+    return MotionGate(logger=logger, scale=settings['scale'], threshold=settings['threshold'],
+                      min_area=settings['min_area'], frozen_threshold=settings['frozen_threshold'])
@@ -0,0 +1,208 @@
+import collections
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import tracemalloc
+
+import _ped_trk.timer
+
+
+class Profiler(_ped_trk.timer.Timeable):
+    """
+    Samples Python stacks of the tracking thread, times stages of the pipeline with the memory they retain,
+    and snapshots allocations periodically to expose growth
+    """
+    # A number of the top growing allocation sites to report per snapshot
+    _GROWTH_TOP_NUM = 10
+
+    def __init__(self, logger, folder_path, interval_ms, snapshot_every):
+        """
+        Starts profiling the calling thread
+        """
+        super().__init__(logger=logger)
+
+        try:
+            os.mkdir(path=folder_path)
+        except FileExistsError:
+            self.get_logger().warning(f'Purge the profiling location at {folder_path}')
+            shutil.rmtree(path=folder_path)
+            os.mkdir(path=folder_path)
+        self.__folder_path = folder_path
+        self.__snapshot_every = snapshot_every
+
+        self.__stats_per_stage = {}
+        self.__stack = []
+        self.__instrumented = []
+
+        self.__own_tracing = not tracemalloc.is_tracing()
+        if self.__own_tracing:
+            tracemalloc.start()
+        self.__baseline_snapshot = None
+
+        self.__samples = collections.Counter()
+        self.__thread_id = threading.get_ident()
+        self.__interval_s = interval_ms / 1e3
+        self.__stopped = threading.Event()
+        self.__sampler = threading.Thread(target=self.__sample, name='Profiler', daemon=True)
+        self.__sampler.start()
+        self.get_logger().info(f'Start profiling: {{'
+                               f'"path": "{folder_path}", '
+                               f'"interval_ms": {interval_ms}, '
+                               f'"snapshot_every": {snapshot_every}'
+                               f'}}')
+
+    def __sample(self):
+        """
+        Counts collapsed stacks of the profiled thread, rooted at the innermost stage running
+        """
+        while not self.__stopped.wait(timeout=self.__interval_s):
+            frame = sys._current_frames().get(self.__thread_id)
+            if frame is None:
+                continue
+
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+
+            stack = self.__stack
+            stage = stack[-1]['name'] if stack else 'other'
+            self.__samples[';'.join([stage, ] + names[::-1])] += 1
+
+    def __enter_stage(self, name):
+        """
+        """
+        memory, peak = tracemalloc.get_traced_memory()
+        if self.__stack:
+            self.__stack[-1]['peak'] = max(self.__stack[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+
+        record = {'name': name, 'start': time.perf_counter(), 'memory': memory, 'peak': memory, 'children_s': 0.}
+        self.__stack.append(record)
+        return record
+
+    def __exit_stage(self, record):
+        """
+        Accounts a stage with its own time, i.e. excluding nested stages, and with memory it allocated
+        """
+        self.__stack.pop()
+        elapsed_s = time.perf_counter() - record['start']
+        memory, peak = tracemalloc.get_traced_memory()
+        peak = max(peak, record['peak'])
+        tracemalloc.reset_peak()
+
+        stats = self.__stats_per_stage.setdefault(record['name'], {'calls': 0, 'total_s': 0., 'self_s': 0.,
+                                                                   'memory_net_bytes': 0, 'memory_peak_bytes': 0})
+        stats['calls'] += 1
+        stats['total_s'] += elapsed_s
+        stats['self_s'] += elapsed_s - record['children_s']
+        # Memory freed outside of stages, e.g. frames dropped by the main loop, doesn't make it to the net value
+        stats['memory_net_bytes'] += memory - record['memory']
+        stats['memory_peak_bytes'] = max(stats['memory_peak_bytes'], peak - record['memory'])
+        if self.__stack:
+            self.__stack[-1]['children_s'] += elapsed_s
+            self.__stack[-1]['peak'] = max(self.__stack[-1]['peak'], peak)
+
+    def instrument(self, obj, name, stage):
+        """
+        Accounts calls of a method of an object to a stage, until profiling is over
+        """
+        method = getattr(obj, name)
+
+        def staged(*args, **kwargs):
+            # Stages are accounted at the profiled thread only, e.g. detection of a pipelined tracker runs elsewhere
+            if threading.get_ident() != self.__thread_id:
+                return method(*args, **kwargs)
+
+            record = self.__enter_stage(name=stage)
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.__exit_stage(record=record)
+
+        setattr(obj, name, staged)
+        self.__instrumented.append((obj, name))
+
+    def on_frame(self, frames_num):
+        """
+        Snapshots allocations every few frames, and reports sites grown the most since the first snapshot
+        """
+        if frames_num % self.__snapshot_every:
+            return
+
+        snapshot = tracemalloc.take_snapshot().filter_traces(filters=(
+            tracemalloc.Filter(inclusive=False, filename_pattern=tracemalloc.__file__),
+            tracemalloc.Filter(inclusive=False, filename_pattern=__file__)
+        ))
+        if self.__baseline_snapshot is None:
+            self.__baseline_snapshot = snapshot
+            return
+
+        growth = [{'site': str(s.traceback), 'size_diff_kb': round(s.size_diff / 1024, 1), 'count_diff': s.count_diff}
+                  for s in snapshot.compare_to(old_snapshot=self.__baseline_snapshot, key_type='lineno')
+                  [:self._GROWTH_TOP_NUM] if 0 < s.size_diff]
+        self.get_logger().info(f'Report memory growth: {{'
+                               f'"frames_num": {frames_num}, '
+                               f'"top": {json.dumps(growth)}'
+                               f'}}')
+        with open(file=os.path.join(self.__folder_path, 'memory_growth.jsonl'), mode='a') as fp:
+            fp.write(json.dumps({'frames_num': frames_num, 'top': growth}) + '\n')
+
+    def __get_table(self, stats_per_stage):
+        """
+        Formats stats of stages as a text table
+        """
+        total_s = sum(s['self_s'] for s in stats_per_stage.values()) or 1.
+        rows = [('stage', 'calls', 'total_s', 'self_s', 'self_%', 'mean_ms', 'memory_net_kb', 'memory_peak_kb')]
+        for name, s in sorted(stats_per_stage.items(), key=lambda item: -item[1]['self_s']):
+            rows.append((name, str(s['calls']), f'{s["total_s"]:.3f}', f'{s["self_s"]:.3f}',
+                         f'{100 * s["self_s"] / total_s:.1f}', f'{1e3 * s["total_s"] / s["calls"]:.3f}',
+                         f'{s["memory_net_bytes"] / 1024:.1f}', f'{s["memory_peak_bytes"] / 1024:.1f}'))
+        widths = [max(len(r[i]) for r in rows) for i in range(len(rows[0]))]
+        return '\n'.join('  '.join(v.ljust(w) if 0 == i else v.rjust(w) for i, (v, w) in enumerate(zip(r, widths)))
+                         for r in rows)
+
+    def close(self):
+        """
+        Stops profiling, restores instrumented methods and stores the results
+        """
+        self.__stopped.set()
+        self.__sampler.join()
+        for obj, name in self.__instrumented:
+            delattr(obj, name)
+        self.__instrumented = []
+        if self.__own_tracing:
+            tracemalloc.stop()
+
+        # Store stacks in the collapsed format of flamegraph.pl, speedscope and alike
+        stacks_path = os.path.join(self.__folder_path, 'stacks.collapsed')
+        with open(file=stacks_path, mode='w') as fp:
+            for stack, count in sorted(self.__samples.items()):
+                fp.write(f'{stack} {count}\n')
+
+        stats_per_stage = {name: dict(s) for name, s in self.__stats_per_stage.items()}
+        json.dump(obj=stats_per_stage, fp=open(file=os.path.join(self.__folder_path, 'stages.json'), mode='w'),
+                  indent=2)
+        table = self.__get_table(stats_per_stage=stats_per_stage)
+        with open(file=os.path.join(self.__folder_path, 'stages.txt'), mode='w') as fp:
+            fp.write(table + '\n')
+
+        self.get_logger().info(f'Report profiled stages:\n{table}')
+        self.get_logger().info(f'Store profiles at {self.__folder_path}: {{'
+                               f'"samples_num": {sum(self.__samples.values())}, '
+                               f'"stacks_num": {len(self.__samples)}'
+                               f'}}')
+
+
+def create_profiler(logger, args):
+    """
+    """
+    if 'on' != args['profile']:
+        return None
+
+    return Profiler(logger=logger, folder_path=os.path.abspath(os.path.join(args['output_root'], 'profile')),
+                    interval_ms=args['profile_interval_ms'], snapshot_every=args['profile_snapshot_every'])
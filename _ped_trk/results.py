@@ -0,0 +1,198 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+
+class ResultsWriter:
+    """
+    Streams per-frame tracking results to append-only chunks of columnar .npz files, and to MOTChallenge text.
+    Memory is bounded by a single chunk and the live tracks. Boxes are stored in coordinates of the source, i.e. mapped
+    back from frames decoded at a scale
+    """
+    EVENTS = ('established', 'tracked', 'dismissed', 'interpolated')
+    COLUMNS = (
+        ('frame_id', np.int64),
+        ('track_id', np.int64),
+        ('l', np.int32),
+        ('t', np.int32),
+        ('w', np.int32),
+        ('h', np.int32),
+        ('score', np.float32),
+        ('event', np.int8)
+    )
+    INDEX_FILE_NAME = 'index.json'
+
+    def __init__(self, logger, args, formats, chunk_rows, scale=1.):
+        """
+        """
+        self.__logger = logger
+        self.__scale = scale
+
+        results_folder_path = os.path.abspath(os.path.join(args['output_root'], 'results'))
+        try:
+            os.mkdir(path=results_folder_path)
+        except FileExistsError:
+            self.__logger.warning(f'Purge the results location at {results_folder_path}')
+            shutil.rmtree(path=results_folder_path)
+            os.mkdir(path=results_folder_path)
+        self.__folder_path = results_folder_path
+        self.__logger.info(f'Store tracking results at {results_folder_path}')
+
+        # Establish the columnar store
+        self.__npz = 'npz' in formats
+        self.__chunk_rows = chunk_rows
+        self.__columns = {n: np.empty(shape=chunk_rows, dtype=t) for n, t in self.COLUMNS}
+        self.__rows_num = 0
+        self.__chunks = []
+        self.__new_tracks = []
+
+        # Establish the MOTChallenge store
+        self.__mot = None
+        if 'mot' in formats:
+            self.__mot = open(file=os.path.join(results_folder_path, 'mot.txt'), mode='w', encoding='utf-8')
+
+        # Map stable ids to dense ones, and remember last known states of live tracks to report their dismissal
+        self.__next_track_id = 1
+        self.__track_id_per_id = {}
+        self.__state_per_id = {}
+
+    def __get_track_id(self, t_id):
+        """
+        """
+        if t_id not in self.__track_id_per_id:
+            self.__track_id_per_id[t_id] = self.__next_track_id
+            self.__new_tracks.append((self.__next_track_id, str(t_id)))
+            self.__next_track_id += 1
+
+        return self.__track_id_per_id[t_id]
+
+    def __to_source(self, rect):
+        """
+        Maps a box of a decoded frame back to the source
+        """
+        if 1 == self.__scale:
+            return rect
+
+        return tuple(int(round(v / self.__scale)) for v in rect)
+
+    def __append(self, frame_id, track_id, rect, score, event):
+        """
+        """
+        if self.__npz:
+            i = self.__rows_num
+            row = (frame_id, track_id) + tuple(rect) + (score, self.EVENTS.index(event))
+            for (name, _), value in zip(self.COLUMNS, row):
+                self.__columns[name][i] = value
+            self.__rows_num += 1
+            if self.__rows_num == self.__chunk_rows:
+                self.__flush_chunk()
+
+        if self.__mot is not None and 'dismissed' != event:
+            l, t, w, h = rect
+            # MOTChallenge frames are 1-based
+            self.__mot.write(f'{frame_id + 1},{track_id},{l},{t},{w},{h},{score:.4f},-1,-1,-1\n')
+
+    def __flush_chunk(self):
+        """
+        Stores buffered rows as a new chunk and updates the index
+        """
+        if not self.__rows_num and not self.__new_tracks:
+            return
+
+        rows_num = self.__rows_num
+        file_name = f'chunk_{len(self.__chunks):06}.npz'
+        track_ids, track_uuids = zip(*self.__new_tracks) if self.__new_tracks else ((), ())
+        np.savez(os.path.join(self.__folder_path, file_name),
+                 track_ids=np.array(track_ids, dtype=np.int64),
+                 track_uuids=np.array(track_uuids, dtype='U36'),
+                 **{n: self.__columns[n][:rows_num] for n, _ in self.COLUMNS})
+
+        frame_ids = self.__columns['frame_id'][:rows_num]
+        self.__chunks.append({
+            'file_name': file_name,
+            'rows_num': rows_num,
+            'first_frame_id': int(frame_ids[0]) if rows_num else None,
+            'last_frame_id': int(frame_ids[-1]) if rows_num else None
+        })
+        self.__rows_num = 0
+        self.__new_tracks = []
+
+        self.__store_index()
+
+    def __store_index(self):
+        """
+        """
+        index = {
+            'columns': [n for n, _ in self.COLUMNS],
+            'decode_scale': self.__scale,
+            'events': list(self.EVENTS),
+            'chunks': self.__chunks
+        }
+        index_path = os.path.join(self.__folder_path, self.INDEX_FILE_NAME)
+        with open(file=f'{index_path}.tmp', mode='w') as fp:
+            json.dump(obj=index, fp=fp, indent=2)
+        os.replace(f'{index_path}.tmp', index_path)
+
+    def act(self, frame_id, done_ids, est_ids, tracker):
+        """
+        Appends results of a frame
+        """
+        # Report dismissed tracks with their last known states
+        for d_id in done_ids:
+            state = self.__state_per_id.pop(d_id, None)
+            if state is None:
+                continue
+
+            self.__append(frame_id=frame_id, track_id=self.__track_id_per_id.pop(d_id), event='dismissed', **state)
+
+        for track in tracker.get_tracks():
+            t_id = track.get_id()
+            state = {'rect': self.__to_source(rect=track.get_last_rect()), 'score': track.get_score()}
+            self.__state_per_id[t_id] = state
+            event = 'established' if t_id in est_ids else 'interpolated' if track.is_interpolated() else 'tracked'
+            self.__append(frame_id=frame_id, track_id=self.__get_track_id(t_id=t_id), event=event, **state)
+
+    def close(self):
+        """
+        Stores the pending rows
+        """
+        if self.__npz:
+            self.__flush_chunk()
+            self.__store_index()
+        if self.__mot is not None:
+            self.__mot.close()
+            self.__mot = None
+
+
+def load_results(folder_path):
+    """
+    Loads all the chunks of a results folder as columns of arrays, with a map of dense track ids to stable ones
+    """
+    index = json.load(fp=open(file=os.path.join(folder_path, ResultsWriter.INDEX_FILE_NAME)))
+
+    columns = {n: [] for n in index['columns']}
+    uuid_per_track_id = {}
+    for chunk in index['chunks']:
+        with np.load(os.path.join(folder_path, chunk['file_name'])) as data:
+            for n in columns:
+                columns[n].append(data[n])
+            uuid_per_track_id.update(zip(data['track_ids'].tolist(), data['track_uuids'].tolist()))
+
+    results = {n: np.concatenate(cs) if cs else np.empty(shape=0, dtype=t)
+               for (n, cs), (_, t) in zip(columns.items(), ResultsWriter.COLUMNS)}
+    results['events'] = index['events']
+    results['uuid_per_track_id'] = uuid_per_track_id
+    return results
+
+
+def create_results_writer(logger, args):
+    """
+    """
+    formats = args['results_formats']
+    if not formats:
+        return None
+
+    return ResultsWriter(logger=logger, args=args, formats=formats, chunk_rows=args['results_chunk_rows'],
+                         scale=args['decode_scale'])
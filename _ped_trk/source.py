@@ -0,0 +1,394 @@
+import os
+import queue
+import stat
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import _ped_trk.metrics
+import _ped_trk.timer
+
+
+class FrameSource(_ped_trk.timer.Timeable):
+    """
+    Decodes frames of a video or an image sequence in background, so decoding overlaps with tracking
+    """
+    _IMAGE_EXTENSIONS = ('.bmp', '.jpeg', '.jpg', '.png', '.tif', '.tiff')
+    _IMAGE_SEQUENCE_FPS = 25
+    _REDUCED_IMREAD_FLAGS = {
+        1 / 2: cv2.IMREAD_REDUCED_COLOR_2,
+        1 / 4: cv2.IMREAD_REDUCED_COLOR_4,
+        1 / 8: cv2.IMREAD_REDUCED_COLOR_8
+    }
+    __POLL_PERIOD_S = 0.1
+
+    def __init__(self, logger, path, stride=1, scale=1., prefetch=8):
+        """
+        Opens a source and starts decoding it
+        """
+        super().__init__(logger=logger)
+
+        # Everything release() touches is set ahead of any validation, since __del__ calls it for failed sources too
+        self.__stopped = threading.Event()
+        self.__decoder = None
+        self.__capture, self.__image_paths = None, None
+        if stride < 1:
+            raise ValueError(f'Decoding stride must be positive, got {stride}')
+        if not 0 < scale <= 1:
+            raise ValueError(f'Decoding scale must be within (0, 1], got {scale}')
+        if prefetch < 1:
+            raise ValueError(f'Prefetch depth must be positive, got {prefetch}')
+
+        self.__stride = stride
+        self.__scale = scale
+
+        if os.path.isdir(path):
+            self.__image_paths = sorted(os.path.join(path, n) for n in os.listdir(path)
+                                        if os.path.splitext(n)[1].lower() in self._IMAGE_EXTENSIONS)
+            if not self.__image_paths:
+                raise ValueError(f'Failed to find images at {path}')
+            native_fps = self._IMAGE_SEQUENCE_FPS
+            native_h, native_w = cv2.imread(filename=self.__image_paths[0]).shape[:2]
+        else:
+            self.__capture = cv2.VideoCapture(filename=path)
+            if not self.__capture.isOpened():
+                raise ValueError(f'Failed to open {path}')
+            native_fps = self.__capture.get(cv2.CAP_PROP_FPS)
+            native_w = int(self.__capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+            native_h = int(self.__capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+        self.__fps = native_fps / stride
+        self.__frame_size = int(native_w * scale), int(native_h * scale)
+        self.get_logger().info(f'Open a frame source: {{'
+                               f'"path": "{path}", '
+                               f'"stride": {stride}, '
+                               f'"scale": {scale}, '
+                               f'"prefetch": {prefetch}, '
+                               f'"fps": {self.__fps}, '
+                               f'"frame_size": {self.__frame_size}'
+                               f'}}')
+
+        self.__frames = queue.Queue(maxsize=prefetch)
+        self.__exhausted = False
+        self.__last_frame_id = None
+        self.__decoder = threading.Thread(target=self.__decode, name='FrameSource', daemon=True)
+        self.__decoder.start()
+
+    def __del__(self):
+        self.release()
+
+    def __downscale(self, frame):
+        """
+        """
+        if 1 == self.__scale or frame.shape[1::-1] == self.__frame_size:
+            return frame
+
+        return cv2.resize(src=frame, dsize=self.__frame_size, interpolation=cv2.INTER_AREA)
+
+    def __decode_video(self):
+        """
+        Yields frames of a video, skipped frames are grabbed, but never retrieved
+        """
+        frame_id = 0
+        while True:
+            if 0 == frame_id % self.__stride:
+                status, frame = self.__capture.read()
+                if not status:
+                    return
+                yield frame_id, self.__downscale(frame=frame)
+            elif not self.__capture.grab():
+                return
+
+            frame_id += 1
+
+    def __decode_images(self):
+        """
+        Yields frames of an image sequence, reduced images are decoded directly, if the scale permits
+        """
+        flags = self._REDUCED_IMREAD_FLAGS.get(self.__scale, cv2.IMREAD_COLOR)
+        for frame_id in range(0, len(self.__image_paths), self.__stride):
+            frame = cv2.imread(filename=self.__image_paths[frame_id], flags=flags)
+            if frame is None:
+                self.get_logger().warning(f'Fail to read an image at {self.__image_paths[frame_id]}')
+                return
+            yield frame_id, self.__downscale(frame=frame)
+
+    def __put(self, item):
+        """
+        Waits for a room at the queue, unless the source is released
+        """
+        while not self.__stopped.is_set():
+            try:
+                self.__frames.put(item=item, timeout=self.__POLL_PERIOD_S)
+            except queue.Full:
+                continue
+            return True
+
+        return False
+
+    def __decode(self):
+        """
+        """
+        frames = self.__decode_video() if self.__capture is not None else self.__decode_images()
+        try:
+            for item in frames:
+                if not self.__put(item=item):
+                    return
+        except Exception as e:
+            self.get_logger().error(f'Fail to decode a frame: {e}')
+        finally:
+            # Mark the end of the source
+            self.__put(item=None)
+
+    def __get(self):
+        """
+        Waits for a decoded frame, unless the source is released, which yields None the same way the end of it does
+        """
+        while not self.__stopped.is_set():
+            try:
+                return self.__frames.get(timeout=self.__POLL_PERIOD_S)
+            except queue.Empty:
+                continue
+
+        return None
+
+    @_ped_trk.timer.timer(label='frame_read')
+    def read(self):
+        """
+        Returns the next decoded frame the same way cv2.VideoCapture.read does, a released source has no frames
+        """
+        if self.__exhausted:
+            return False, None
+
+        queue_depth = self.__frames.qsize()
+        item = self.__get()
+        if item is None:
+            self.__exhausted = True
+            return False, None
+
+        self.__last_frame_id, frame = item
+        self.get_logger().debug(f'Read a frame: {{'
+                                f'"frame_id": {self.__last_frame_id}, '
+                                f'"queue_depth": {queue_depth}'
+                                f'}}')
+        return True, frame
+
+    def get_last_frame_id(self):
+        """
+        Returns a zero-based index of the last read frame at the original source
+        """
+        return self.__last_frame_id
+
+    def get_fps(self):
+        """
+        Returns a frame rate of decoded frames, i.e. the one with stride applied
+        """
+        return self.__fps
+
+    def get_frame_size(self):
+        """
+        Returns a width-height tuple of decoded frames
+        """
+        return self.__frame_size
+
+    def release(self):
+        """
+        Stops decoding and frees the source
+        """
+        if self.__stopped.is_set():
+            return
+
+        self.__stopped.set()
+        if self.__decoder is not None:
+            self.__decoder.join()
+        if self.__capture is not None:
+            self.__capture.release()
+
+
+class LiveFrameSource(_ped_trk.timer.Timeable):
+    """
+    Captures frames of a live stream in background and keeps the freshest one only, so tracking never works on
+    a backlog. Frames captured while tracking is busy are dropped. A stream is a device index, a URL, or a named pipe
+    or stdin, i.e. "-", carrying raw BGR frames
+    """
+    __JOIN_TIMEOUT_S = 1.
+
+    def __init__(self, logger, path, scale=1., raw_size=None, fps=25.):
+        """
+        Opens a stream and starts capturing it, a size of raw frames and a frame rate have to be given for pipes,
+        the frame rate is used for streams not telling one as well
+        """
+        super().__init__(logger=logger)
+
+        # Everything release() touches is set ahead of any validation, since __del__ calls it for failed sources too
+        self.__stopped = threading.Event()
+        self.__condition = threading.Condition()
+        self.__capturer = None
+        self.__capture, self.__raw_file, self.__raw_size = None, None, raw_size
+        if not 0 < scale <= 1:
+            raise ValueError(f'Decoding scale must be within (0, 1], got {scale}')
+        self.__scale = scale
+
+        if '-' == path or os.path.exists(path) and stat.S_ISFIFO(os.stat(path).st_mode):
+            if raw_size is None:
+                raise ValueError(f'A size of raw frames is required to read them from {path}')
+            self.__raw_file = sys.stdin.buffer if '-' == path else open(file=path, mode='rb')
+            native_fps = fps
+            native_w, native_h = raw_size
+        else:
+            self.__capture = cv2.VideoCapture(int(path) if path.isdigit() else path)
+            if not self.__capture.isOpened():
+                raise ValueError(f'Failed to open {path}')
+            native_fps = self.__capture.get(cv2.CAP_PROP_FPS) or fps
+            native_w = int(self.__capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+            native_h = int(self.__capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+        self.__fps = native_fps
+        self.__frame_size = int(native_w * scale), int(native_h * scale)
+        self.get_logger().info(f'Open a live frame source: {{'
+                               f'"path": "{path}", '
+                               f'"raw": {str(self.__raw_file is not None).lower()}, '
+                               f'"scale": {scale}, '
+                               f'"fps": {self.__fps}, '
+                               f'"frame_size": {self.__frame_size}'
+                               f'}}')
+
+        # The freshest captured frame as an id, a capture time and the frame, or None, if it's read already
+        self.__latest = None
+        self.__exhausted = False
+        self.__captured_num = 0
+        self.__dropped_num = 0
+        self.__last_frame_id = None
+        self.__last_captured_at = None
+        self.__capturer = threading.Thread(target=self.__capture_frames, name='LiveFrameSource', daemon=True)
+        self.__capturer.start()
+
+    def __del__(self):
+        self.release()
+
+    def __downscale(self, frame):
+        """
+        """
+        if 1 == self.__scale or frame.shape[1::-1] == self.__frame_size:
+            return frame
+
+        return cv2.resize(src=frame, dsize=self.__frame_size, interpolation=cv2.INTER_AREA)
+
+    def __read_raw(self):
+        """
+        Yields raw frames of a pipe, every frame is read into a buffer of its own, since frames are kept by consumers
+        """
+        raw_w, raw_h = self.__raw_size
+        frame_bytes = raw_w * raw_h * 3
+        while True:
+            frame = np.empty(shape=(raw_h, raw_w, 3), dtype=np.uint8)
+            view = memoryview(frame).cast('B')
+            read_bytes = 0
+            while read_bytes < frame_bytes:
+                num = self.__raw_file.readinto(view[read_bytes:])
+                if not num:
+                    return
+                read_bytes += num
+            yield frame
+
+    def __read_capture(self):
+        """
+        """
+        while True:
+            status, frame = self.__capture.read()
+            if not status:
+                return
+            yield frame
+
+    def __capture_frames(self):
+        """
+        Replaces the freshest frame with every captured one, replaced unread frames are dropped
+        """
+        frames = self.__read_raw() if self.__raw_file is not None else self.__read_capture()
+        try:
+            for frame in frames:
+                if self.__stopped.is_set():
+                    return
+                captured_at = time.perf_counter()
+                frame = self.__downscale(frame=frame)
+                with self.__condition:
+                    if self.__latest is not None:
+                        self.__dropped_num += 1
+                        _ped_trk.metrics.get_registry().increment(label='dropped_frames_stale')
+                    self.__latest = self.__captured_num, captured_at, frame
+                    self.__captured_num += 1
+                    self.__condition.notify()
+        except Exception as e:
+            self.get_logger().error(f'Fail to capture a frame: {e}')
+        finally:
+            # Mark the end of the stream
+            with self.__condition:
+                self.__exhausted = True
+                self.__condition.notify()
+
+    @_ped_trk.timer.timer(label='frame_read')
+    def read(self):
+        """
+        Waits for a frame captured since the last read one, and returns it the same way cv2.VideoCapture.read does,
+        a released source has no frames
+        """
+        with self.__condition:
+            while self.__latest is None and not self.__exhausted and not self.__stopped.is_set():
+                self.__condition.wait()
+            if self.__latest is None or self.__stopped.is_set():
+                return False, None
+            (self.__last_frame_id, self.__last_captured_at, frame), self.__latest = self.__latest, None
+
+        return True, frame
+
+    def get_last_frame_id(self):
+        """
+        Returns a zero-based index of the last read frame among the captured ones
+        """
+        return self.__last_frame_id
+
+    def get_last_captured_at(self):
+        """
+        Returns a time.perf_counter() moment the last read frame was captured at
+        """
+        return self.__last_captured_at
+
+    def get_stats(self):
+        """
+        Returns numbers of captured frames and of the ones dropped for fresher ones
+        """
+        with self.__condition:
+            return {'captured_num': self.__captured_num, 'dropped_num': self.__dropped_num}
+
+    def get_fps(self):
+        """
+        """
+        return self.__fps
+
+    def get_frame_size(self):
+        """
+        """
+        return self.__frame_size
+
+    def release(self):
+        """
+        Stops capturing and frees the stream. A capture blocked by a silent stream is left to exit with the process
+        """
+        if self.__stopped.is_set():
+            return
+
+        self.__stopped.set()
+        with self.__condition:
+            self.__condition.notify_all()
+        if self.__capturer is not None:
+            self.__capturer.join(timeout=self.__JOIN_TIMEOUT_S)
+            if self.__capturer.is_alive():
+                self.get_logger().warning('Leave a live frame source blocked by the stream')
+                return
+        if self.__capture is not None:
+            self.__capture.release()
+        if self.__raw_file is not None and self.__raw_file is not sys.stdin.buffer:
+            self.__raw_file.close()
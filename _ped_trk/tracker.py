@@ -24,6 +24,19 @@ class Track(metaclass=abc.ABCMeta):
         """
         pass
 
+    @abc.abstractmethod
+    def get_score(self):
+        """
+        Returns a score of a detection the track was seeded with
+        """
+        pass
+
+    def is_interpolated(self):
+        """
+        Tells whether the last position is predicted rather than tracked
+        """
+        return False
+
 
 class Tracker(metaclass=abc.ABCMeta):
     """
@@ -31,8 +44,9 @@ class Tracker(metaclass=abc.ABCMeta):
     """
 
     @abc.abstractmethod
-    def track(self, frame):
+    def track(self, frame, detections=None):
         """
+        Tracks objects at a frame, detections of the frame might be provided, if they are known in advance
         """
         pass
 
@@ -47,3 +61,15 @@ class Tracker(metaclass=abc.ABCMeta):
         """
         """
         pass
+
+    def get_max_history(self):
+        """
+        Returns a number of the latest positions a track keeps, None stands for all of them
+        """
+        return None
+
+    def close(self):
+        """
+        Releases resources once tracking is over
+        """
+        pass
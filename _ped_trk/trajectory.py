@@ -0,0 +1,97 @@
+import numpy as np
+
+
+class Trajectory:
+    """
+    Keeps the most recent rects of a track with their centers in a ring buffer of a bounded length, or all of them,
+    if the length isn't bounded. Centers are computed once per rect, and the recent items are always exposed
+    as contiguous read-only views
+    """
+    # A capacity an unbounded trajectory starts with, it doubles, once the trajectory gets full
+    _INITIAL_CAPACITY = 64
+
+    def __init__(self, max_len, rect):
+        """
+        """
+        if max_len is not None and max_len < 1:
+            raise ValueError(f'Trajectory length must be positive, got {max_len}')
+
+        self.__max_len = max_len
+        self.__capacity = self._INITIAL_CAPACITY if max_len is None else max_len
+        # Every item is stored twice, the capacity apart, so the recent items always form a single slice
+        self.__rects = np.empty(shape=(2 * self.__capacity, 4), dtype=np.int32)
+        self.__centers = np.empty(shape=(2 * self.__capacity, 2), dtype=np.int32)
+        self.__last = -1
+        self.__len = 0
+        self.__last_rect = None
+        self.__last_center = None
+
+        self.append(rect=rect)
+
+    def __len__(self):
+        return self.__len
+
+    def append(self, rect):
+        """
+        """
+        l, t, w, h = (int(round(v)) for v in rect)
+        center = l + w // 2, t + h // 2
+
+        if self.__max_len is None and self.__len == self.__capacity:
+            self.__grow()
+
+        i = (self.__last + 1) % self.__capacity
+        self.__rects[i] = self.__rects[i + self.__capacity] = (l, t, w, h)
+        self.__centers[i] = self.__centers[i + self.__capacity] = center
+        self.__last = i
+        self.__len = min(self.__len + 1, self.__capacity)
+
+        self.__last_rect = l, t, w, h
+        self.__last_center = center
+
+    def __grow(self):
+        """
+        Doubles the capacity of a full trajectory, the items are laid out from the oldest one again
+        """
+        capacity = 2 * self.__capacity
+
+        def regrow(items):
+            recent = self.__get_recent(items=items)
+            grown = np.empty(shape=(2 * capacity, items.shape[1]), dtype=items.dtype)
+            grown[:self.__len] = grown[capacity:capacity + self.__len] = recent
+            return grown
+
+        self.__rects = regrow(items=self.__rects)
+        self.__centers = regrow(items=self.__centers)
+        self.__capacity = capacity
+        self.__last = self.__len - 1
+
+    def __get_recent(self, items):
+        """
+        """
+        end = self.__last + self.__capacity + 1
+        view = items[end - self.__len:end]
+        view.flags.writeable = False
+        return view
+
+    def get_rects(self):
+        """
+        Returns the recent rects as a left-top-width-height array from the oldest to the newest one
+        """
+        return self.__get_recent(items=self.__rects)
+
+    def get_centers(self):
+        """
+        Returns centers of the recent rects as an x-y array from the oldest to the newest one
+        """
+        return self.__get_recent(items=self.__centers)
+
+    def get_last_rect(self):
+        """
+        """
+        return self.__last_rect
+
+    def get_last_center(self):
+        """
+        """
+        return self.__last_center
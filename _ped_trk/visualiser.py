@@ -1,19 +1,208 @@
 import abc
 import os
+import queue
 import shutil
+import threading
 
 import cv2
+import numpy as np
+
+
+class AsyncSink:
+    """
+    Runs output jobs, e.g. encoding and writing of annotated frames, on a bounded pool of worker threads
+    """
+
+    def __init__(self, logger, workers, queue_size, backpressure):
+        """
+        """
+        if backpressure not in ('block', 'drop'):
+            raise ValueError(f'Unknown backpressure policy: {backpressure}')
+
+        self.__logger = logger
+        self.__backpressure = backpressure
+        self.__jobs = queue.Queue(maxsize=queue_size)
+        self.__dropped_num = 0
+        self.__submitted_num = 0
+        self.__closed = False
+
+        self.__workers = [threading.Thread(target=self.__work, name=f'AsyncSink-{i}', daemon=True)
+                          for i in range(workers)]
+        [w.start() for w in self.__workers]
+        self.__logger.info(f'Establish an asynchronous sink: {{'
+                           f'"workers": {workers}, '
+                           f'"queue_size": {queue_size}, '
+                           f'"backpressure": "{backpressure}"'
+                           f'}}')
+
+    def __work(self):
+        """
+        """
+        while True:
+            job = self.__jobs.get()
+            try:
+                if job is None:
+                    return
+
+                function, kwargs = job
+                function(**kwargs)
+            except Exception as e:
+                self.__logger.error(f'Fail to run an output job: {e}')
+            finally:
+                self.__jobs.task_done()
+
+    def submit(self, function, **kwargs):
+        """
+        Schedules a job, returns False, if the job was dropped due to backpressure
+        """
+        self.__submitted_num += 1
+        if 'block' == self.__backpressure:
+            self.__jobs.put(item=(function, kwargs))
+            return True
+
+        try:
+            self.__jobs.put_nowait(item=(function, kwargs))
+        except queue.Full:
+            self.__dropped_num += 1
+            self.__logger.debug(f'Drop an output job: {{'
+                                f'"dropped_num": {self.__dropped_num}, '
+                                f'"submitted_num": {self.__submitted_num}'
+                                f'}}')
+            return False
+
+        return True
+
+    def flush(self):
+        """
+        Waits for all the scheduled jobs to complete
+        """
+        self.__jobs.join()
+
+    def close(self):
+        """
+        Flushes the jobs and stops the workers
+        """
+        if self.__closed:
+            return
+
+        self.__closed = True
+        self.flush()
+        [self.__jobs.put(item=None) for _ in self.__workers]
+        [w.join() for w in self.__workers]
+        self.__logger.info(f'Close an asynchronous sink: {{'
+                           f'"submitted_num": {self.__submitted_num}, '
+                           f'"dropped_num": {self.__dropped_num}'
+                           f'}}')
+
+
+class _TrailLayer:
+    """
+    Keeps trails of tracks drawn at a persistent layer, so a frame costs drawing of new points only.
+    The layer is redrawn from the live tracks, when some trailed track dies, or once per a bound of track histories,
+    to forget points gone out of them
+    """
+    # Trails don't depend on the state of a track at a frame, so the layer keeps them as they are
+    RADIUS = 2
+
+    def __init__(self):
+        """
+        """
+        self.__layer = None
+        self.__mask = None
+        self.__extent = None
+        self.__trailed_ids = set()
+        self.__frames_since_refresh = 0
+        # Set, once some trailed track dies at a frame, which isn't drawn
+        self.__stale = False
+
+    def __reset(self, shape):
+        """
+        """
+        if self.__layer is None or self.__layer.shape != shape:
+            self.__layer = np.zeros(shape=shape, dtype=np.uint8)
+            self.__mask = np.zeros(shape=shape[:2], dtype=np.uint8)
+        elif self.__extent is not None:
+            l, t, r, b = self.__extent
+            self.__layer[t:b, l:r] = 0
+            self.__mask[t:b, l:r] = 0
+
+        self.__extent = None
+        self.__trailed_ids = set()
+        self.__frames_since_refresh = 0
+        self.__stale = False
+
+    def __draw(self, points, color):
+        """
+        """
+        for p in points.tolist():
+            cv2.circle(img=self.__layer, center=p, radius=self.RADIUS, color=color, lineType=cv2.FILLED)
+            # The color may be black, so drawn pixels are marked separately
+            cv2.circle(img=self.__mask, center=p, radius=self.RADIUS, color=1, lineType=cv2.FILLED)
+
+        # Keep a bounding box of drawn pixels to blend it only
+        h, w = self.__mask.shape
+        l, t = np.clip(points.min(axis=0) - self.RADIUS, a_min=0, a_max=(w, h)).tolist()
+        r, b = np.clip(points.max(axis=0) + self.RADIUS + 1, a_min=0, a_max=(w, h)).tolist()
+        if self.__extent is not None:
+            l, t = min(l, self.__extent[0]), min(t, self.__extent[1])
+            r, b = max(r, self.__extent[2]), max(b, self.__extent[3])
+        self.__extent = l, t, r, b
+
+    def update(self, shape, tracks, done_ids, get_color, scale, refresh_every=None):
+        """
+        Brings the layer up to date with the live tracks, a layer of unbounded histories is never refreshed periodically
+        """
+        self.__frames_since_refresh += 1
+        if self.__layer is None or self.__layer.shape != shape \
+                or refresh_every is not None and refresh_every <= self.__frames_since_refresh \
+                or self.__stale or not self.__trailed_ids.isdisjoint(done_ids):
+            self.__reset(shape=shape)
+
+        for track in tracks:
+            t_id = track.get_id()
+            centers = track.get_centers()
+            if t_id not in self.__trailed_ids:
+                self.__trailed_ids.add(t_id)
+            else:
+                centers = centers[-1:]
+            self.__draw(points=(centers * scale).astype(np.int32) if 1 != scale else centers,
+                        color=get_color(t_id=t_id))
+
+    def forget(self, done_ids):
+        """
+        Marks the layer to be redrawn, if some trailed track died at a frame, which isn't drawn
+        """
+        self.__stale = self.__stale or not self.__trailed_ids.isdisjoint(done_ids)
+
+    def blend(self, frame):
+        """
+        Copies the drawn pixels over a frame
+        """
+        if self.__extent is None:
+            return
+
+        l, t, r, b = self.__extent
+        cv2.copyTo(src=self.__layer[t:b, l:r], mask=self.__mask[t:b, l:r], dst=frame[t:b, l:r])
 
 
 class Visualiser(metaclass=abc.ABCMeta):
     """
     Provides a common interface for all kinds of visualizers
     """
+    _FONT_FACE = cv2.FONT_HERSHEY_PLAIN
+    _FONT_SCALE = 1
+    _TEXT_THICKNESS = 2
 
-    def __init__(self, logger):
+    def __init__(self, logger, sink=None, incremental=False):
         self._logger = logger
+        self.__sink = sink
         self.__color_per_id = {}
 
+        # Incremental rendering keeps trails and labels between frames
+        self._incremental = incremental
+        self.__trails = _TrailLayer() if incremental else None
+        self.__label_per_id = {}
+
     def __get_color(self, t_id):
         """
         Computes a stable color for a track with stable id
@@ -23,9 +212,37 @@ class Visualiser(metaclass=abc.ABCMeta):
 
         return self.__color_per_id[t_id]
 
-    def _draw(self, frame, done_ids, est_ids, tracker):
+    def __get_label(self, t_id):
+        """
+        Renders object's id once per track as a sprite, its bottom-left corner is the text origin
+        """
+        if t_id not in self.__label_per_id:
+            text = str(t_id)[:8]
+            (text_w, text_h), _ = cv2.getTextSize(text=text, fontFace=self._FONT_FACE, fontScale=self._FONT_SCALE,
+                                                  thickness=self._TEXT_THICKNESS)
+            label = np.empty(shape=(text_h + 1, text_w + 1, 3), dtype=np.uint8)
+            label[:] = self.__get_color(t_id=t_id)
+            cv2.putText(img=label, text=text, org=(0, text_h), fontFace=self._FONT_FACE, fontScale=self._FONT_SCALE,
+                        color=(0, 0, 0))
+            self.__label_per_id[t_id] = label
+
+        return self.__label_per_id[t_id]
+
+    @staticmethod
+    def __paste(frame, sprite, l, t):
+        """
+        Copies a sprite to a frame, clipping it by frame borders
         """
-        Draws tracking results for a frame at it
+        frame_h, frame_w = frame.shape[:2]
+        sprite_h, sprite_w = sprite.shape[:2]
+        s_l, s_t = max(0, -l), max(0, -t)
+        s_r, s_b = min(sprite_w, frame_w - l), min(sprite_h, frame_h - t)
+        if s_l < s_r and s_t < s_b:
+            frame[t + s_t:t + s_b, l + s_l:l + s_r] = sprite[s_t:s_b, s_l:s_r]
+
+    def __draw_fully(self, frame, est_ids, tracker):
+        """
+        Draws everything from scratch
         """
         # Show ROI
         roi = tracker.get_roi()
@@ -36,32 +253,91 @@ class Visualiser(metaclass=abc.ABCMeta):
             t_id = track.get_id()
             t_color = self.__get_color(t_id=t_id)
 
-            # Show an object at the frame
+            # Show an object at the frame, a thin box marks a predicted position
             last_rect = track.get_last_rect()
-            thickness = 4 if t_id in est_ids else 2
+            thickness = 4 if t_id in est_ids else 1 if track.is_interpolated() else 2
             cv2.rectangle(img=frame, pt1=last_rect[:2], pt2=[last_rect[i] + last_rect[i + 2] for i in range(2)],
                           color=t_color, thickness=thickness)
 
             # Show object's id
             text = str(t_id)[:8]
-            font_face = cv2.FONT_HERSHEY_PLAIN
-            font_scale = 1
-            text_thickness = 2
-            text_size, _ = cv2.getTextSize(text=text, fontFace=font_face, fontScale=font_scale,
-                                           thickness=text_thickness)
+            text_size, _ = cv2.getTextSize(text=text, fontFace=self._FONT_FACE, fontScale=self._FONT_SCALE,
+                                           thickness=self._TEXT_THICKNESS)
             cv2.rectangle(img=frame, pt1=last_rect[:2],
                           pt2=[c + k * s for c, s, k in zip(last_rect[:2], text_size, [1, -1])],
                           color=t_color, thickness=cv2.FILLED)
-            cv2.putText(img=frame, text=text, org=last_rect[:2], fontFace=font_face, fontScale=font_scale,
+            cv2.putText(img=frame, text=text, org=last_rect[:2], fontFace=self._FONT_FACE, fontScale=self._FONT_SCALE,
                         color=(0, 0, 0))
 
-            # Show positions of the object at the previous frames
+            # Show positions of the object at the previous frames, as large as the trails kept incrementally are
             for p in track.get_centers():
-                cv2.circle(img=frame, center=p, radius=thickness, color=t_color, lineType=cv2.FILLED)
+                cv2.circle(img=frame, center=p, radius=_TrailLayer.RADIUS, color=t_color, lineType=cv2.FILLED)
 
-        # Dismiss colors for deceased tracks
+    def __draw_incrementally(self, frame, done_ids, est_ids, tracker, scale):
+        """
+        Draws boxes and cached labels, and blends the trails kept since the previous frames
+        """
+        to_display = (lambda vs: [int(round(v * scale)) for v in vs]) if 1 != scale else list
+
+        # Show ROI
+        roi = to_display(tracker.get_roi())
+        cv2.rectangle(img=frame, pt1=roi[:2], pt2=[roi[i] + roi[i + 2] for i in range(2)], color=(0, 255, 0),
+                      thickness=8)
+
+        tracks = list(tracker.get_tracks())
+        for track in tracks:
+            t_id = track.get_id()
+
+            # Show an object at the frame, a thin box marks a predicted position
+            last_rect = to_display(track.get_last_rect())
+            thickness = 4 if t_id in est_ids else 1 if track.is_interpolated() else 2
+            cv2.rectangle(img=frame, pt1=last_rect[:2], pt2=[last_rect[i] + last_rect[i + 2] for i in range(2)],
+                          color=self.__get_color(t_id=t_id), thickness=thickness)
+
+            # Show object's id above the object
+            label = self.__get_label(t_id=t_id)
+            self.__paste(frame=frame, sprite=label, l=last_rect[0], t=last_rect[1] - label.shape[0] + 1)
+
+        # Show positions of objects at the previous frames, the trails forget old ones as fast as track histories do
+        self.__trails.update(shape=frame.shape, tracks=tracks, done_ids=done_ids, get_color=self.__get_color,
+                             scale=scale, refresh_every=tracker.get_max_history())
+        self.__trails.blend(frame=frame)
+
+    def _draw(self, frame, done_ids, est_ids, tracker, scale=1.):
+        """
+        Draws tracking results for a frame at it, a scale maps frame coordinates of tracks to the given frame
+        """
+        if self._incremental:
+            self.__draw_incrementally(frame=frame, done_ids=done_ids, est_ids=est_ids, tracker=tracker, scale=scale)
+        else:
+            self.__draw_fully(frame=frame, est_ids=est_ids, tracker=tracker)
+
+        # Dismiss colors and labels for deceased tracks
+        self.__dismiss(done_ids=done_ids)
+
+    def __dismiss(self, done_ids):
+        """
+        """
         for d_id in done_ids:
-            del self.__color_per_id[d_id]
+            self.__color_per_id.pop(d_id, None)
+            self.__label_per_id.pop(d_id, None)
+
+    def forget(self, done_ids):
+        """
+        Dismisses whatever is kept for tracks, which died at a frame skipped rather than visualized
+        """
+        self.__dismiss(done_ids=done_ids)
+        if self.__trails is not None:
+            self.__trails.forget(done_ids=done_ids)
+
+    def _emit(self, function, **kwargs):
+        """
+        Runs an output job right away or hands it over to the sink, the frames passed must not be reused after that
+        """
+        if self.__sink is None:
+            function(**kwargs)
+        else:
+            self.__sink.submit(function, **kwargs)
 
     @abc.abstractmethod
     def act(self, frame, done_ids, est_ids, tracker):
@@ -70,14 +346,21 @@ class Visualiser(metaclass=abc.ABCMeta):
         """
         return False
 
+    def close(self):
+        """
+        Completes all the pending output
+        """
+        if self.__sink is not None:
+            self.__sink.close()
+
 
 class Viewer(Visualiser):
     """
     Visualizes tracking results with a live video via GUI
     """
 
-    def __init__(self, logger):
-        super().__init__(logger=logger)
+    def __init__(self, logger, incremental=False):
+        super().__init__(logger=logger, incremental=incremental)
 
         self.__window_name = 'Tracking some objects'
         self.__width = 800
@@ -87,12 +370,18 @@ class Viewer(Visualiser):
         cv2.destroyWindow(winname=self.__window_name)
 
     def act(self, frame, done_ids, est_ids, tracker):
-        self._draw(frame=frame, done_ids=done_ids, est_ids=est_ids, tracker=tracker)
-
         if self.__height is None:
             self.__height = int(self.__width * frame.shape[0] / frame.shape[1])
 
-        frame = cv2.resize(src=frame, dsize=(self.__width, self.__height))
+        if self._incremental:
+            # Draw right at the display resolution
+            scale = self.__width / frame.shape[1]
+            frame = cv2.resize(src=frame, dsize=(self.__width, self.__height))
+            self._draw(frame=frame, done_ids=done_ids, est_ids=est_ids, tracker=tracker, scale=scale)
+        else:
+            self._draw(frame=frame, done_ids=done_ids, est_ids=est_ids, tracker=tracker)
+            frame = cv2.resize(src=frame, dsize=(self.__width, self.__height))
+
         cv2.imshow(winname=self.__window_name, mat=frame)
 
         # Wrap up, if user told so
@@ -105,8 +394,8 @@ class Tracer(Visualiser):
     Visualizes tracking results with separate frames
     """
 
-    def __init__(self, logger, args):
-        super().__init__(logger=logger)
+    def __init__(self, logger, args, sink=None):
+        super().__init__(logger=logger, sink=sink, incremental='incremental' == args['render_mode'])
 
         trace_folder_path = os.path.abspath(os.path.join(args['output_root'], 'trace'))
         try:
@@ -125,7 +414,7 @@ class Tracer(Visualiser):
         self.__frame_counter += 1
         file_path = os.path.abspath(os.path.join(self.__trace_folder_path, f'frame_{self.__frame_counter:05}.jpg'))
         self._logger.debug(f'Annotate a frame at {file_path}')
-        cv2.imwrite(filename=file_path, img=frame)
+        self._emit(cv2.imwrite, filename=file_path, img=frame)
 
         return True
 
@@ -135,38 +424,65 @@ class Writer(Visualiser):
     Visualizes tracking results with a video
     """
 
-    def __init__(self, logger, args, reader):
-        super().__init__(logger=logger)
+    def __init__(self, logger, args, source, sink=None):
+        super().__init__(logger=logger, sink=sink, incremental='incremental' == args['render_mode'])
 
-        video_name, video_ext = os.path.splitext(os.path.basename(args['video_path']))
+        video_name, video_ext = os.path.splitext(os.path.basename(os.path.normpath(args['video_path'])))
         annotated_video_path = os.path.abspath(os.path.join(args['output_root'], f'{video_name}_annotated.avi'))
         self._logger.info(f'Annotate video at {annotated_video_path}')
 
         # Force Motion JPEG to mitigate codecs hassles
         fourcc = cv2.VideoWriter_fourcc(*'MJPG')
-        fps = int(reader.get(cv2.CAP_PROP_FPS))
-        size = int(reader.get(cv2.CAP_PROP_FRAME_WIDTH)), int(reader.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = int(source.get_fps())
+        size = source.get_frame_size()
         self.__writer = cv2.VideoWriter(filename=annotated_video_path, fourcc=fourcc, fps=fps, frameSize=size)
 
     def __del__(self):
-        self.__writer.release()
+        self.close()
 
     def act(self, frame, done_ids, est_ids, tracker):
         self._draw(frame=frame, done_ids=done_ids, est_ids=est_ids, tracker=tracker)
 
-        self.__writer.write(image=frame)
+        self._emit(self.__writer.write, image=frame)
+
+        return True
+
+    def close(self):
+        super().close()
+        self.__writer.release()
+
+
+class NullVisualiser(Visualiser):
+    """
+    Presents nothing, so the pipeline throughput can be measured alone
+    """
 
+    def act(self, frame, done_ids, est_ids, tracker):
         return True
 
 
-def create_visualizer(logger, args, reader):
+def _create_sink(logger, args, workers):
+    """
+    """
+    if 'async' != args['sink_mode']:
+        return None
+
+    return AsyncSink(logger=logger, workers=workers, queue_size=args['sink_queue_size'],
+                     backpressure=args['sink_backpressure'])
+
+
+def create_visualizer(logger, args, source):
     """
     """
     vt = args['visualizer_type']
     visualiser = {
-        'tracer': lambda: Tracer(logger=logger, args=args),
-        'writer': lambda: Writer(logger=logger, args=args, reader=reader),
-        'viewer': lambda: Viewer(logger=logger)
+        'tracer': lambda: Tracer(logger=logger, args=args,
+                                 sink=_create_sink(logger=logger, args=args, workers=args['sink_workers'])),
+        # A video has to be written in order, so a single worker is affordable only
+        'writer': lambda: Writer(logger=logger, args=args, source=source,
+                                 sink=_create_sink(logger=logger, args=args, workers=1)),
+        'viewer': lambda: Viewer(logger=logger, incremental='incremental' == args['render_mode']),
+        'null': lambda: NullVisualiser(logger=logger)
     }[vt]()
 
     return visualiser
@@ -0,0 +1,331 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import _ped_trk.visualiser
+from benchmarks.scene import SyntheticScene
+from pm_pedestrians_tracker.src import association
+
+
+def _collect_arguments():
+    """
+    """
+    parser = argparse.ArgumentParser(description='Benchmarks stages of tracking on a synthetic scene',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--settings_file_path', type=str,
+                        default=os.path.join('pm_pedestrians_tracker', 'config', 'settings.json'),
+                        help='A path to a file with settings for the detector and the tracker')
+    parser.add_argument('--strategies', type=str, nargs='+', choices=['pm', 'cm'], default=['pm', 'cm'],
+                        help='Tracking strategies to measure end-to-end throughput of')
+    parser.add_argument('--size', type=int, nargs=2, default=[1280, 720], help='A width-height tuple of frames')
+    parser.add_argument('--objects_num', type=int, default=8, help='A number of moving objects')
+    parser.add_argument('--object_size', type=int, nargs=2, default=[40, 100],
+                        help='A nominal width-height tuple of objects, every one deviates from it up to 20%%')
+    parser.add_argument('--speed', type=float, default=3., help='A speed of objects in pixels per frame')
+    parser.add_argument('--occluders_num', type=int, default=2, help='A number of static pillars hiding objects')
+    parser.add_argument('--seed', type=int, default=0, help='A seed of the scene')
+    parser.add_argument('--frames_num', type=int, default=200, help='A number of frames to track objects at')
+    parser.add_argument('--repeats', type=int, default=50, help='A number of runs of every micro-benchmark')
+    parser.add_argument('--detector_variants', type=str, nargs='*', default=[],
+                        help='Name=path pairs of pm model variants, e.g. FP16 or INT8-quantized ONNX files, to compare '
+                             'latency and detections of with the first one')
+    parser.add_argument('--video_path', type=str, default=None,
+                        help='A path to store the scene as a video at, e.g. to feed main.py with it')
+    parser.add_argument('--output_path', type=str, required=True, help='A path to store results as JSON at')
+    parser.add_argument('--baseline_path', type=str, default=None,
+                        help='A path to results of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=.1,
+                        help='A relative change for the worse to treat as a regression')
+
+    return vars(parser.parse_args())
+
+
+def _measure_ms(function, repeats, warmup=3):
+    """
+    Returns a median latency of a function in milliseconds
+    """
+    for _ in range(warmup):
+        function()
+
+    elapsed_ms = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        elapsed_ms.append((time.perf_counter() - start) * 1e3)
+
+    return statistics.median(elapsed_ms)
+
+
+def _result(value, unit, higher_is_better=False):
+    """
+    """
+    return {'value': round(value, 4), 'unit': unit, 'higher_is_better': higher_is_better}
+
+
+def _has_model(settings):
+    """
+    """
+    return os.path.exists(settings['detector']['weights_file_path'])
+
+
+class _Drawer(_ped_trk.visualiser.Visualiser):
+    """
+    Draws tracking results without presenting them anywhere
+    """
+
+    def act(self, frame, done_ids, est_ids, tracker):
+        self._draw(frame=frame, done_ids=done_ids, est_ids=est_ids, tracker=tracker)
+        return True
+
+
+def _create_oracle_tracker(logger, settings, scene, frames_num):
+    """
+    Tracks objects of a scene with ground truth detections, so no model is needed
+    """
+    from pm_pedestrians_tracker.src.tracker import Tracker
+
+    tracker = Tracker(logger=logger, detector=None, settings=settings['tracker'], roi=None)
+    for frame, boxes in scene.frames(num=frames_num):
+        tracker.track(frame=frame, detections=[{'lt_wh': b, 'score': 1.} for b in boxes])
+
+    return tracker
+
+
+def _bench_association(scene, repeats):
+    """
+    """
+    _, boxes = scene.render(frame_id=0)
+    rng = np.random.default_rng(seed=0)
+    t_rects = np.asarray(boxes) + rng.integers(low=-4, high=5, size=(len(boxes), 4))
+    d_rects = np.asarray(boxes) + rng.integers(low=-4, high=5, size=(len(boxes), 4))
+
+    def associate():
+        ious = association.iou_matrix(rects_a=t_rects, rects_b=d_rects)
+        association.associate_hungarian(ious=ious, iou_threshold=.5)
+
+    return {'association_ms': _result(value=_measure_ms(function=associate, repeats=repeats), unit='ms')}
+
+
+def _bench_detector(logger, settings, scene, repeats):
+    """
+    """
+    from pm_pedestrians_tracker.src.detector import Detector
+
+    detector = Detector(logger=logger, settings=settings['detector'])
+    frame, _ = scene.render(frame_id=0)
+    results = {'pre_process_ms': _result(value=_measure_ms(function=lambda: detector._pre_process(frame=frame),
+                                                           repeats=repeats), unit='ms')}
+
+    # Feed post-processing with raw outputs of the YOLOv5 layout, some of which pass the thresholds
+    rng = np.random.default_rng(seed=0)
+    objects = rng.random(size=(25200, 85), dtype=np.float32)
+    objects[:, :2] *= 640
+    objects[:, 2:4] *= 100
+    objects[:, 5:] *= .5
+    objects[:50, 5] += .6
+    results['post_process_ms'] = _result(value=_measure_ms(
+        function=lambda: detector._post_process(objects=objects, coeff_h=1., coeff_w=1.), repeats=repeats), unit='ms')
+
+    return results
+
+
+def _get_agreement(reference_per_frame, detections_per_frame, iou_threshold=.5):
+    """
+    Returns an F1 score of detections matched to reference ones over all the frames
+    """
+    matches_num, reference_num, detections_num = 0, 0, 0
+    for reference, detections in zip(reference_per_frame, detections_per_frame):
+        reference_num += len(reference)
+        detections_num += len(detections)
+        if reference and detections:
+            ious = association.iou_matrix(rects_a=np.array([d['lt_wh'] for d in reference]),
+                                          rects_b=np.array([d['lt_wh'] for d in detections]))
+            matches_num += len(association.associate_hungarian(ious=ious, iou_threshold=iou_threshold))
+
+    return 2 * matches_num / (reference_num + detections_num) if reference_num + detections_num else 1.
+
+
+def _bench_detector_variants(logger, settings, scene, frames_num, variants):
+    """
+    Compares latency of model variants at the frames of a scene, and agreement of their detections with the first one
+    """
+    from pm_pedestrians_tracker.src.detector import Detector
+
+    frames = [frame for frame, _ in scene.frames(num=frames_num)]
+    results, reference_per_frame = {}, None
+    for variant in variants:
+        name, path = variant.split(sep='=', maxsplit=1)
+        detector = Detector(logger=logger, settings=dict(settings['detector'], weights_file_path=path))
+
+        elapsed_ms, detections_per_frame = [], []
+        for frame in frames:
+            start = time.perf_counter()
+            detections_per_frame.append(detector.detect(frame=frame))
+            elapsed_ms.append((time.perf_counter() - start) * 1e3)
+
+        results[f'detect_{name}_ms'] = _result(value=statistics.median(elapsed_ms), unit='ms')
+        if reference_per_frame is None:
+            reference_per_frame = detections_per_frame
+            continue
+        results[f'detect_{name}_agreement'] = _result(value=_get_agreement(reference_per_frame=reference_per_frame,
+                                                                           detections_per_frame=detections_per_frame),
+                                                      unit='f1', higher_is_better=True)
+
+    return results
+
+
+def _bench_draw(logger, settings, scene, frames_num, repeats):
+    """
+    """
+    tracker = _create_oracle_tracker(logger=logger, settings=settings, scene=scene, frames_num=frames_num)
+    frame, _ = scene.render(frame_id=frames_num)
+
+    results = {}
+    for render_mode in ('full', 'incremental'):
+        drawer = _Drawer(logger=logger, incremental='incremental' == render_mode)
+        draw = lambda: drawer.act(frame=frame, done_ids=[], est_ids=[], tracker=tracker)
+        results[f'draw_{render_mode}_ms'] = _result(value=_measure_ms(function=draw, repeats=repeats), unit='ms')
+
+    return results
+
+
+def _bench_end_to_end(logger, settings, scene, frames_num, strategy):
+    """
+    Measures throughput of tracking alone, frames are rendered off the clock
+    """
+    if 'pm' == strategy:
+        from pm_pedestrians_tracker.src.detector import Detector
+        from pm_pedestrians_tracker.src.tracker import Tracker
+    else:
+        from cm_pedestrians_tracker.src.detector import Detector
+        from cm_pedestrians_tracker.src.tracker import Tracker
+
+    detector = Detector(logger=logger, settings=settings['detector'])
+    tracker = Tracker(logger=logger, detector=detector, settings=settings['tracker'], roi=None)
+
+    elapsed_s = 0.
+    for frame, _ in scene.frames(num=frames_num):
+        start = time.perf_counter()
+        tracker.track(frame=frame)
+        elapsed_s += time.perf_counter() - start
+
+    return {f'{strategy}_fps': _result(value=frames_num / elapsed_s, unit='fps', higher_is_better=True)}
+
+
+def _bench_oracle(logger, settings, scene, frames_num):
+    """
+    Measures throughput of the pm tracker fed with ground truth, i.e. without the model
+    """
+    start = time.perf_counter()
+    _create_oracle_tracker(logger=logger, settings=settings, scene=scene, frames_num=frames_num)
+    elapsed_s = time.perf_counter() - start
+
+    return {'pm_oracle_fps': _result(value=frames_num / elapsed_s, unit='fps', higher_is_better=True)}
+
+
+def _compare(results, baseline, threshold):
+    """
+    Compares results with a baseline, returns changes per benchmark and names of regressed ones
+    """
+    changes, regressions = {}, []
+    for name, result in results.items():
+        reference = baseline['results'].get(name)
+        if reference is None or not reference['value']:
+            continue
+
+        change = result['value'] / reference['value'] - 1.
+        worsening = -change if result['higher_is_better'] else change
+        changes[name] = {'baseline': reference['value'], 'value': result['value'], 'change': round(change, 4)}
+        if threshold < worsening:
+            regressions.append(name)
+
+    return changes, regressions
+
+
+def main():
+    """
+    """
+    args = _collect_arguments()
+
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s')
+    logger = logging.getLogger('Benchmark')
+    logger.setLevel(logging.INFO)
+    # Keep components quiet, their logs would cost more than the stages measured
+    tracker_logger = logging.getLogger('Benchmark.Tracker')
+    tracker_logger.setLevel(logging.WARNING)
+
+    settings = json.load(fp=open(file=args['settings_file_path']))
+    scene = SyntheticScene(size=tuple(args['size']), objects_num=args['objects_num'],
+                           object_size=tuple(args['object_size']), speed=args['speed'],
+                           occluders_num=args['occluders_num'], seed=args['seed'])
+    if args['video_path'] is not None:
+        scene.write_video(path=args['video_path'], num=args['frames_num'])
+        logger.info(f'Store the scene at {os.path.abspath(args["video_path"])}')
+
+    results, skipped = {}, {}
+    results.update(_bench_association(scene=scene, repeats=args['repeats']))
+    results.update(_bench_draw(logger=tracker_logger, settings=settings, scene=scene, frames_num=args['frames_num'],
+                               repeats=args['repeats']))
+    results.update(_bench_oracle(logger=tracker_logger, settings=settings, scene=scene,
+                                 frames_num=args['frames_num']))
+    if _has_model(settings=settings):
+        results.update(_bench_detector(logger=tracker_logger, settings=settings, scene=scene, repeats=args['repeats']))
+    else:
+        skipped['pre_process_ms'] = skipped['post_process_ms'] = 'no model weights'
+    missing_variants = [v for v in args['detector_variants'] if not os.path.exists(v.split(sep='=', maxsplit=1)[-1])]
+    if missing_variants:
+        skipped['detector_variants'] = f'no model weights: {missing_variants}'
+    elif args['detector_variants']:
+        results.update(_bench_detector_variants(logger=tracker_logger, settings=settings, scene=scene,
+                                                frames_num=args['repeats'], variants=args['detector_variants']))
+    for strategy in args['strategies']:
+        if 'pm' == strategy and not _has_model(settings=settings):
+            skipped['pm_fps'] = 'no model weights'
+            continue
+        results.update(_bench_end_to_end(logger=tracker_logger, settings=settings, scene=scene,
+                                         frames_num=args['frames_num'], strategy=strategy))
+
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count()
+        },
+        'scene': {k: args[k] for k in ('size', 'objects_num', 'object_size', 'speed', 'occluders_num', 'seed',
+                                       'frames_num')},
+        'results': results,
+        'skipped': skipped
+    }
+
+    regressions = []
+    if args['baseline_path'] is not None:
+        baseline = json.load(fp=open(file=args['baseline_path']))
+        if baseline['scene'] != report['scene']:
+            logger.warning('Compare results of different scenes')
+        report['comparison'], regressions = _compare(results=results, baseline=baseline, threshold=args['threshold'])
+        report['regressions'] = regressions
+
+    with open(file=args['output_path'], mode='w') as fp:
+        json.dump(obj=report, fp=fp, indent=2)
+    logger.info(f'Report benchmarks: {json.dumps(results)}')
+    logger.info(f'Store benchmarks at {os.path.abspath(args["output_path"])}')
+    for name, reason in skipped.items():
+        logger.warning(f'Skip a benchmark: {{"name": "{name}", "reason": "{reason}"}}')
+    if regressions:
+        logger.error(f'Find regressions beyond {args["threshold"]:.0%}: {regressions}')
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
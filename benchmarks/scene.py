@@ -0,0 +1,93 @@
+import cv2
+import numpy as np
+
+
+class SyntheticScene:
+    """
+    Renders a deterministic scene of textured rectangles bouncing over a textured background, with ground truth.
+    Positions are computed in closed form per frame, so any frame can be rendered independently of the others
+    """
+
+    def __init__(self, size=(1280, 720), objects_num=8, object_size=(40, 100), speed=3., occluders_num=2, seed=0):
+        """
+        Sizes are width-height tuples, a speed is in pixels per frame. Occluders are static pillars drawn above objects
+        """
+        self.__size = size
+        frame_w, frame_h = size
+        rng = np.random.default_rng(seed=seed)
+
+        # Keep the background smooth, so objects stand out of it as pedestrians do
+        background = rng.integers(low=0, high=256, size=(frame_h // 16 + 1, frame_w // 16 + 1, 3), dtype=np.uint8)
+        self.__background = cv2.resize(src=background, dsize=size, interpolation=cv2.INTER_CUBIC)
+
+        self.__objects = []
+        for _ in range(objects_num):
+            w, h = (max(4, int(s * rng.uniform(low=.8, high=1.2))) for s in object_size)
+            w, h = min(w, frame_w - 1), min(h, frame_h - 1)
+            angle = rng.uniform(low=0., high=2 * np.pi)
+            self.__objects.append({
+                'texture': rng.integers(low=0, high=256, size=(h, w, 3), dtype=np.uint8),
+                'origin': (rng.uniform(low=0., high=frame_w - w), rng.uniform(low=0., high=frame_h - h)),
+                'velocity': (speed * np.cos(angle), speed * np.sin(angle))
+            })
+
+        self.__occluders = []
+        for _ in range(occluders_num):
+            w = int(rng.integers(low=max(2, frame_w // 64), high=max(3, frame_w // 24)))
+            l = int(rng.integers(low=0, high=frame_w - w))
+            self.__occluders.append(((l, 0, w, frame_h), rng.integers(low=0, high=256, size=3).tolist()))
+
+    @staticmethod
+    def __bounce(origin, velocity, frame_id, extent):
+        """
+        Moves a coordinate at a constant speed, reflecting it off the borders of [0, extent]
+        """
+        if extent <= 0:
+            return 0
+
+        position = (origin + velocity * frame_id) % (2 * extent)
+        return int(position if position <= extent else 2 * extent - position)
+
+    def get_size(self):
+        """
+        """
+        return self.__size
+
+    def render(self, frame_id):
+        """
+        Returns a frame with left-top-width-height boxes of objects at it, objects are listed from the farthest one
+        """
+        frame_w, frame_h = self.__size
+        frame = self.__background.copy()
+
+        boxes = []
+        for o in self.__objects:
+            h, w = o['texture'].shape[:2]
+            l = self.__bounce(origin=o['origin'][0], velocity=o['velocity'][0], frame_id=frame_id, extent=frame_w - w)
+            t = self.__bounce(origin=o['origin'][1], velocity=o['velocity'][1], frame_id=frame_id, extent=frame_h - h)
+            frame[t:t + h, l:l + w] = o['texture']
+            boxes.append((l, t, w, h))
+
+        for (l, t, w, h), color in self.__occluders:
+            cv2.rectangle(img=frame, pt1=(l, t), pt2=(l + w, t + h), color=color, thickness=cv2.FILLED)
+
+        return frame, boxes
+
+    def frames(self, num):
+        """
+        Yields frames with boxes one by one
+        """
+        for frame_id in range(num):
+            yield self.render(frame_id=frame_id)
+
+    def write_video(self, path, num, fps=25):
+        """
+        Stores frames as a Motion JPEG video
+        """
+        writer = cv2.VideoWriter(filename=path, fourcc=cv2.VideoWriter_fourcc(*'MJPG'), fps=fps,
+                                 frameSize=self.__size)
+        try:
+            for frame, _ in self.frames(num=num):
+                writer.write(image=frame)
+        finally:
+            writer.release()
@@ -14,10 +14,14 @@ class Detector(_ped_trk.timer.Timeable):
         super().__init__(logger=logger)
 
     @_ped_trk.timer.timer(label='obj_det')
-    def detect(self, frame):
+    def detect(self, frame, roi=None):
         """
+        Makes up objects at a frame, within the ROI, if it's given
         """
+        left, top = 0, 0
         height, width, *_ = frame.shape
+        if roi is not None:
+            left, top, width, height = roi
 
         boxes = []
         num = np.random.randint(low=0, high=5)
@@ -29,8 +33,16 @@ class Detector(_ped_trk.timer.Timeable):
 
             w = np.random.randint(low=1, high=(width - l))
             h = np.random.randint(low=1, high=(height - t))
-            boxes.append((l, t, w, h))
+            boxes.append((left + l, top + t, w, h))
         scores = np.random.rand(len(boxes))
 
         class_objs = [{'lt_wh': b, 'score': s} for b, s in zip(boxes, scores)]
         return class_objs
+
+    @_ped_trk.timer.timer(label='obj_det_batch')
+    def detect_batch(self, frames, roi=None):
+        """
+        Keeps the interface of a batched detector, there is nothing to gain from batching here though
+        """
+        class_objs_per_frame = [self.detect(frame=frame, roi=roi) for frame in frames]
+        return class_objs_per_frame
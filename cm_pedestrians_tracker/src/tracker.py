@@ -2,8 +2,11 @@ import logging
 import random
 import uuid
 
+import _ped_trk.metrics
+import _ped_trk.motion
 import _ped_trk.timer
 import _ped_trk.tracker
+import _ped_trk.trajectory
 
 
 class _Track(_ped_trk.tracker.Track, _ped_trk.timer.Timeable):
@@ -25,12 +28,13 @@ class _Track(_ped_trk.tracker.Track, _ped_trk.timer.Timeable):
         return l + w // 2, t + h // 2
 
     @_ped_trk.timer.timer(label='trk_creation')
-    def __init__(self, logger, frame, seed_detection):
+    def __init__(self, logger, frame, seed_detection, max_history):
         """
         """
         super().__init__(logger=logger)
 
-        self.__points = [seed_detection['lt_wh'], ]
+        self.__trajectory = _ped_trk.trajectory.Trajectory(max_len=max_history, rect=seed_detection['lt_wh'])
+        self.__score = float(seed_detection['score'])
         self.__id = self.__get_unique_stable_id()
 
     def get_id(self):
@@ -40,14 +44,19 @@ class _Track(_ped_trk.tracker.Track, _ped_trk.timer.Timeable):
 
     def get_centers(self):
         """
+        Returns a read-only view of the recent centers, from the oldest to the newest one
         """
-        cs = [(l + w // 2, t + h // 2) for (l, t, w, h) in self.__points]
-        return cs
+        return self.__trajectory.get_centers()
 
     def get_last_rect(self):
         """
         """
-        return self.__points[-1]
+        return self.__trajectory.get_last_rect()
+
+    def get_score(self):
+        """
+        """
+        return self.__score
 
 
 class Tracker(_ped_trk.tracker.Tracker, _ped_trk.timer.Timeable):
@@ -70,7 +79,12 @@ class Tracker(_ped_trk.tracker.Tracker, _ped_trk.timer.Timeable):
         self.__detector = detector
 
         self.__roi = roi
+        self.__max_history = settings['max_history']
+        self.__motion_gate = _ped_trk.motion.create_motion_gate(logger=logger, settings=settings['motion'])
+        self.__limit_detection = settings['motion']['limit_detection']
         self.get_logger().info(f'Establish a tracker: {{'
+                               f'"max_history": {self.__max_history}, '
+                               f'"motion_gating": {str(self.__motion_gate is not None).lower()}, '
                                f'"roi": {self.__roi}'
                                f'}}')
 
@@ -98,8 +112,9 @@ class Tracker(_ped_trk.tracker.Tracker, _ped_trk.timer.Timeable):
         return sorted(self.__tracks.keys())
 
     @_ped_trk.timer.timer(label='frame_handling')
-    def track(self, frame):
+    def track(self, frame, detections=None):
         """
+        Tracks objects at a frame, detections of the frame might be provided, if they are known in advance
         """
         self.__frames_seen += 1
         self.get_logger().debug(f'Track objects: {{'
@@ -111,7 +126,26 @@ class Tracker(_ped_trk.tracker.Tracker, _ped_trk.timer.Timeable):
             self.__roi = 0, 0, frame.shape[1] - 1, frame.shape[0] - 1
             self.get_logger().info(f'Settle the ROI: {{"ltwh": {self.__roi}}}')
 
+        # Keep tracks as they are at frozen frames, and when nothing moved at the ROI since the last detection
+        motion_regions = None
+        if self.__motion_gate is not None:
+            if self.__motion_gate.update(frame=frame):
+                self.get_logger().debug(f'Skip a frozen frame: {{'
+                                        f'"frame_id": {self.__frames_seen}'
+                                        f'}}')
+                _ped_trk.metrics.get_registry().increment(label='frozen_frames')
+                return [], []
+
+            motion_regions = self.__motion_gate.get_regions(roi=self.__roi)
+            if not motion_regions:
+                self.get_logger().debug(f'Skip detection at a still frame: {{'
+                                        f'"frame_id": {self.__frames_seen}'
+                                        f'}}')
+                _ped_trk.metrics.get_registry().increment(label='still_frames')
+                return [], []
+
         # Dismiss all known tracks
+        t_rects = [t.get_last_rect() for t in self.get_tracks()]
         done_ids = [t_id for t_id in self.__get_track_ids()]
         self.get_logger().log(level=logging.INFO if done_ids else logging.DEBUG,
                               msg=f'Dismiss all active tracks: {{'
@@ -121,7 +155,15 @@ class Tracker(_ped_trk.tracker.Tracker, _ped_trk.timer.Timeable):
         self.__dismiss_tracks(t_ids=done_ids)
 
         # Detect all the legit objects
-        detections = [d for d in self.__detector.detect(frame=frame)
+        if detections is None:
+            detection_roi = self.__roi
+            if self.__limit_detection and motion_regions:
+                # Look for objects only where anything moved or was tracked
+                detection_roi = _ped_trk.motion.bound(rects=motion_regions + t_rects, roi=self.__roi)
+            detections = self.__detector.detect(frame=frame, roi=detection_roi)
+        if self.__motion_gate is not None:
+            self.__motion_gate.clear()
+        detections = [d for d in detections
                       if self.__within(rect=self.__roi, center=_Track.center(rect=d['lt_wh']))]
         self.get_logger().debug(f'Detect objects of a frame: {{'
                                 f'"frame_id": {self.__frames_seen}, '
@@ -132,7 +174,8 @@ class Tracker(_ped_trk.tracker.Tracker, _ped_trk.timer.Timeable):
         est_ids = []
         for d in detections:
             try:
-                track = _Track(logger=self.get_logger(), frame=frame, seed_detection=d)
+                track = _Track(logger=self.get_logger(), frame=frame, seed_detection=d,
+                               max_history=self.__max_history)
             except Exception as e:
                 self.__logger.error(f'{e}')
             else:
@@ -156,3 +199,8 @@ class Tracker(_ped_trk.tracker.Tracker, _ped_trk.timer.Timeable):
         """
         """
         return self.__roi
+
+    def get_max_history(self):
+        """
+        """
+        return self.__max_history
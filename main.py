@@ -1,11 +1,16 @@
 import argparse
+import glob
 import json
 import logging
+import multiprocessing
 import os
+import time
 
-import cv2
+import _ped_trk.metrics
 
-from _ped_trk.visualiser import create_visualizer
+# Heavy modules, e.g. of OpenCV and NumPy, are imported where they are needed, so parsing arguments and
+# spreading videos over workers don't pay for them
+_startup = {'started_at': time.perf_counter(), 'detector_s': None, 'reported': False}
 
 
 def _collect_arguments():
@@ -17,15 +22,80 @@ def _collect_arguments():
                         help='A tracking strategy to follow')
     parser.add_argument('--video_path', type=str,
                         default=os.path.join('samples', 'pedestrians_0.mp4'),
-                        help='A path to a video to analyze')
+                        help='A path to a video or a folder with an image sequence to analyze. In the live mode, '
+                             'a device index, a URL, or a named pipe or stdin, i.e. "-", carrying raw BGR frames')
+    parser.add_argument('--live', type=str, choices=['on', 'off'], default='off',
+                        help='Whether to treat the video as a live stream: the freshest frame is always tracked, '
+                             'frames tracking doesn\'t keep up with are dropped')
+    parser.add_argument('--live_max_latency_ms', type=float, default=500.,
+                        help='A maximum capture-to-output latency in the live mode, frames exceeding it are not '
+                             'presented')
+    parser.add_argument('--live_raw_size', type=int, nargs=2, default=None,
+                        help='A width-height tuple of raw frames read from a pipe or stdin in the live mode')
+    parser.add_argument('--live_fps', type=float, default=25.,
+                        help='A frame rate of raw frames, or of streams not telling one, in the live mode')
+    parser.add_argument('--videos', type=str, nargs='+', default=None,
+                        help='Paths or glob patterns of videos to analyze in a batch, overrides --video_path. '
+                             'Every video gets its own folder and log under the output root')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='A number of worker processes to analyze a batch of videos with')
+    parser.add_argument('--threads', type=int, default=-1,
+                        help='A number of threads OpenCV may use per process, a negative one splits cores evenly '
+                             'between worker processes, zero runs OpenCV sequentially')
+    parser.add_argument('--decode_stride', type=int, default=1,
+                        help='A step between decoded frames, skipped frames are not retrieved at all')
+    parser.add_argument('--decode_scale', type=float, default=1.,
+                        help='A scale to decode frames at, must be within (0, 1]. Results are mapped back to '
+                             'coordinates of the source, annotated frames are kept at the scale')
+    parser.add_argument('--prefetch', type=int, default=8,
+                        help='A number of frames to decode ahead of tracking')
+    parser.add_argument('--batch_size', type=int, default=1,
+                        help='A number of frames to detect objects at with a single call of the detector, '
+                             'for the cm strategy only, which detects at every frame. The pm strategy re-detects on '
+                             'schedule, so it ignores batching')
     parser.add_argument('--roi', type=int, nargs=4, default=None,
                         help='A region to watch out for objects at. '
-                             'Must be specified as a left-top-width-height tuple')
+                             'Must be specified as a left-top-width-height tuple in coordinates of the source, '
+                             'it\'s scaled along with decoded frames')
     parser.add_argument('--settings_file_path', type=str,
                         default=os.path.join('pm_pedestrians_tracker', 'config', 'settings.json'),
                         help='A path to a file with settings for the detector')
-    parser.add_argument('--visualizer_type', type=str, choices=['viewer', 'tracer', 'writer'], default='tracer',
-                        help='A way to present results')
+    parser.add_argument('--visualizer_type', type=str, choices=['viewer', 'tracer', 'writer', 'null'],
+                        default='tracer', help='A way to present results, null skips it to measure the pipeline alone')
+    parser.add_argument('--render_mode', type=str, choices=['full', 'incremental'], default='full',
+                        help='A way to draw results, incremental keeps trails and labels between frames')
+    parser.add_argument('--sink_mode', type=str, choices=['sync', 'async'], default='sync',
+                        help='A way to encode and write annotated frames, async moves it off the tracking thread')
+    parser.add_argument('--sink_workers', type=int, default=max(1, min(4, (os.cpu_count() or 1) // 2)),
+                        help='A number of workers to encode and write frames with in the async mode. '
+                             'A writer always uses a single one to keep frames in order')
+    parser.add_argument('--sink_queue_size', type=int, default=32,
+                        help='A number of annotated frames to keep waiting for encoding in the async mode')
+    parser.add_argument('--sink_backpressure', type=str, choices=['block', 'drop'], default='block',
+                        help='What to do with an annotated frame, if the async sink is full')
+    parser.add_argument('--results_formats', type=str, nargs='*', choices=['npz', 'mot'], default=['npz'],
+                        help='Formats to stream per-frame track results in: chunked columnar .npz files '
+                             'and/or MOTChallenge text. Pass none to skip storing results')
+    parser.add_argument('--results_chunk_rows', type=int, default=65536,
+                        help='A number of result rows to keep in memory before storing them as a chunk')
+    parser.add_argument('--detection_cache', type=str, default=None,
+                        help='A path to a folder to cache detections at per video, frame and detector settings, '
+                             'so reruns skip inference of known frames')
+    parser.add_argument('--detection_cache_max_bytes', type=int, default=1 << 30,
+                        help='A size of the detection cache to evict the least recently used entries beyond')
+    parser.add_argument('--detection_cache_invalidate', type=str, choices=['none', 'entry', 'all'], default='none',
+                        help='Whether to drop cached detections of analyzed videos with the current settings, '
+                             'or the whole cache, before the run')
+    parser.add_argument('--metrics', type=str, choices=['on', 'off'], default='on',
+                        help='Whether to collect counters and latency histograms of operations')
+    parser.add_argument('--metrics_period', type=float, default=10.,
+                        help='A period in seconds to dump metrics at, a non-positive one leaves the end-of-run dump only')
+    parser.add_argument('--profile', type=str, choices=['on', 'off'], default='off',
+                        help='Whether to sample stacks, time stages of the pipeline and track memory growth')
+    parser.add_argument('--profile_interval_ms', type=float, default=5.,
+                        help='A period in milliseconds to sample stacks at in the profiling mode')
+    parser.add_argument('--profile_snapshot_every', type=int, default=500,
+                        help='A number of frames to snapshot allocations after in the profiling mode')
     parser.add_argument('--output_root', type=str, required=True, help='A path to a output root')
 
     return vars(parser.parse_args())
@@ -37,11 +107,24 @@ def _secure_output_root(args):
     os.makedirs(name=args['output_root'], exist_ok=True)
 
 
-def _setup_logging(args):
+def _add_file_logging(args, logger, formatter):
+    """
+    """
+    log_path = os.path.abspath(os.path.join(args['output_root'], 'tracker.log'))
+    file = logging.FileHandler(filename=log_path, encoding='utf-8', mode='a')
+    file.setLevel(level=logging.DEBUG)
+    file.setFormatter(fmt=formatter)
+    logger.addHandler(hdlr=file)
+    logger.info(f'Store logs at {log_path}')
+
+    return file
+
+
+def _setup_logging(args, fmt='%(asctime)s [%(levelname)s] %(message)s', file_logging=True):
     """
     """
     logger = logging.getLogger('Tracker')
-    formatter = logging.Formatter(fmt='%(asctime)s [%(levelname)s] %(message)s')
+    formatter = logging.Formatter(fmt=fmt)
     logger.setLevel(logging.DEBUG)
 
     # Configure console logging
@@ -51,68 +134,411 @@ def _setup_logging(args):
     logger.addHandler(hdlr=stdout)
 
     # Configure file logging
-    log_path = os.path.abspath(os.path.join(args['output_root'], 'tracker.log'))
-    file = logging.FileHandler(filename=log_path, encoding='utf-8', mode='a')
-    file.setLevel(level=logging.DEBUG)
-    file.setFormatter(fmt=formatter)
-    logger.addHandler(hdlr=file)
-    logger.info(f'Store logs at {log_path}')
+    if file_logging:
+        _add_file_logging(args=args, logger=logger, formatter=formatter)
 
     return logger
 
 
-def _create_frames_reader(args):
+def _budget_threads(args, logger, workers=1):
     """
+    Caps threads of OpenCV per process, so parallel workers don't oversubscribe cores
     """
-    reader = None
+    import cv2
+
+    threads = args['threads']
+    if threads < 0:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+    cv2.setNumThreads(threads)
+    logger.info(f'Budget threads: {{'
+                f'"threads": {threads}, '
+                f'"opencv_threads": {cv2.getNumThreads()}, '
+                f'"workers": {workers}'
+                f'}}')
 
-    # Check the input video
-    video_path = args['video_path']
-    reader = cv2.VideoCapture(filename=video_path)
-    if not reader.isOpened():
-        raise ValueError(f'Failed to open {video_path}')
 
-    return reader
+def _create_frame_source(args, logger):
+    """
+    """
+    from _ped_trk.source import FrameSource, LiveFrameSource
+
+    if 'on' == args['live']:
+        return LiveFrameSource(logger=logger, path=args['video_path'], scale=args['decode_scale'],
+                               raw_size=args['live_raw_size'], fps=args['live_fps'])
 
+    source = FrameSource(logger=logger, path=args['video_path'], stride=args['decode_stride'],
+                         scale=args['decode_scale'], prefetch=args['prefetch'])
 
-def _create_tracker(args, logger, settings):
+    return source
+
+
+def _create_detector(args, logger, settings):
     """
     """
-    tracker = None
+    start = time.perf_counter()
+    detector = None
 
     strategy = args['strategy']
     if 'pm' == strategy:
         from pm_pedestrians_tracker.src.detector import Detector
-        from pm_pedestrians_tracker.src.tracker import Tracker
         detector = Detector(logger=logger, settings=settings['detector'])
-        tracker = Tracker(logger=logger, detector=detector, settings=settings['tracker'], roi=args['roi'])
     elif 'cm' == strategy:
         from cm_pedestrians_tracker.src.detector import Detector
-        from cm_pedestrians_tracker.src.tracker import Tracker
         detector = Detector(logger=logger, settings=settings['detector'])
+    _startup['detector_s'] = time.perf_counter() - start
+
+    return detector
+
+
+def _create_tracker(args, logger, settings, detector):
+    """
+    """
+    tracker = None
+
+    strategy = args['strategy']
+    if 'pm' == strategy:
+        from pm_pedestrians_tracker.src.tracker import Tracker
+        # The pm detector infers whole frames, unless it's told to crop them to the ROI it's given
+        motion = settings['tracker']['motion']
+        if motion['enabled'] and motion['limit_detection'] and not settings['detector']['roi_crop']:
+            logger.warning('Limit detection to moved regions once the detector crops to the ROI, i.e. roi_crop is on')
+        tracker = Tracker(logger=logger, detector=detector, settings=settings['tracker'], roi=args['roi'])
+    elif 'cm' == strategy:
+        from cm_pedestrians_tracker.src.tracker import Tracker
         tracker = Tracker(logger=logger, detector=detector, settings=settings['tracker'], roi=args['roi'])
 
     return tracker
 
 
-if __name__ == '__main__':
-    args = _collect_arguments()
+def _read_frames(source, num):
+    """
+    Reads up to a number of frames with their ids, fewer ones are returned at the end of the source only
+    """
+    frame_ids, frames = [], []
+    while len(frames) < num:
+        status, frame = source.read()
+        if not status:
+            break
+        frame_ids.append(source.get_last_frame_id())
+        frames.append(frame)
+
+    return frame_ids, frames
+
+
+def _report_striding(logger, settings, summary):
+    """
+    Estimates a speed-up of frame striding, as if every frame cost as much as a natively tracked one
+    """
+    latencies = summary['latencies_ms']
+    handling = latencies.get('frame_handling', {'num': 0})
+    prediction = latencies.get('trk_prediction', {'num': 0})
+    tracked_num = handling['num'] - prediction['num']
+    if not prediction['num'] or not tracked_num:
+        return
+
+    tracked_ms = handling['total'] - prediction['total']
+    speed_up = handling['num'] * tracked_ms / tracked_num / handling['total'] if handling['total'] else 0.
+    logger.info(f'Report frame striding: {{'
+                f'"stride": {settings["tracker"]["stride"]}, '
+                f'"frames_num": {handling["num"]}, '
+                f'"tracked_frames_num": {tracked_num}, '
+                f'"interpolated_frames_num": {prediction["num"]}, '
+                f'"speed_up": {speed_up:.2f}'
+                f'}}')
+
+
+def _report_startup(logger, registry, start):
+    """
+    Reports time to the first handled frame of a video, and of the process for its first video
+    """
+    now = time.perf_counter()
+    registry.record(label='first_frame', ns=int((now - start) * 1e9))
+    if _startup['reported']:
+        return
+
+    _startup['reported'] = True
+    registry.record(label='startup', ns=int((now - _startup['started_at']) * 1e9))
+    logger.info(f'Report startup: {{'
+                f'"startup_s": {now - _startup["started_at"]:.3f}, '
+                f'"detector_s": {_startup["detector_s"] or 0.:.3f}, '
+                f'"first_frame_s": {now - start:.3f}'
+                f'}}')
+
+
+def _report_live(logger, args, source, summary):
+    """
+    Reports frames of a live stream dropped at every stage, and the capture-to-output latency
+    """
+    counters = summary['counters']
+    stats = source.get_stats()
+    latency = summary['latencies_ms'].get('capture_to_output', {})
+    logger.info(f'Report the live stream: {{'
+                f'"captured_frames_num": {stats["captured_num"]}, '
+                f'"tracked_frames_num": {counters.get("frames", 0)}, '
+                f'"dropped_stale_num": {stats["dropped_num"]}, '
+                f'"dropped_late_num": {counters.get("dropped_frames_late", 0)}, '
+                f'"skipped_late_outputs_num": {counters.get("late_outputs_skipped", 0)}, '
+                f'"max_latency_ms": {args["live_max_latency_ms"]}, '
+                f'"latency_p50_ms": {latency.get("p50")}, '
+                f'"latency_p99_ms": {latency.get("p99")}'
+                f'}}')
+
+
+def _track_video(args, logger, settings, detector):
+    """
+    Tracks objects at a single video, returns a number of handled frames
+    """
+    import _ped_trk.detection_cache
+    import _ped_trk.profiler
+    from _ped_trk.results import create_results_writer
+    from _ped_trk.visualiser import create_visualizer
+
+    start = time.perf_counter()
+    registry = _ped_trk.metrics.get_registry()
+    registry.reset()
+    metrics_path = os.path.abspath(os.path.join(args['output_root'], 'metrics.json'))
+    if registry.is_enabled():
+        registry.start_dumping(path=metrics_path, period_s=args['metrics_period'])
+
+    # A live stream has no frames to come back to, so batching and caching don't apply
+    live = 'on' == args['live']
+    if live and (1 < args['batch_size'] or args['detection_cache'] is not None):
+        logger.warning('Ignore batching and the detection cache for a live stream')
+        args = dict(args, batch_size=1, detection_cache=None)
+    max_latency_s = args['live_max_latency_ms'] / 1e3
+    # Frames are decoded at a scale, so the ROI given for the source is brought to them
+    if args['roi'] is not None and 1 != args['decode_scale']:
+        args = dict(args, roi=[int(v * args['decode_scale']) for v in args['roi']])
+    # The pm tracker uses detections at re-detection frames only, so batching would detect at every frame for nothing
+    if 'pm' == args['strategy'] and 1 < args['batch_size']:
+        logger.warning('Ignore batching for the pm strategy, which re-detects on schedule')
+        args = dict(args, batch_size=1)
+
+    # Everything is closed in the end, even if tracking fails, to not leave threads, sampling and dumping running
+    detection_cache, tracker, source, visualiser, results_writer, profiler = None, None, None, None, None, None
+    frames_num = 0
+    try:
+        detection_cache = _ped_trk.detection_cache.create_detection_cache(logger=logger, args=args, settings=settings,
+                                                                          detector=detector)
+        if detection_cache is not None:
+            detector = detection_cache
+        tracker = _create_tracker(args=args, logger=logger, settings=settings, detector=detector)
+
+        source = _create_frame_source(args=args, logger=logger)
+        visualiser = create_visualizer(logger=logger, args=args, source=source)
+        results_writer = create_results_writer(logger=logger, args=args)
+
+        profiler = _ped_trk.profiler.create_profiler(logger=logger, args=args)
+        if profiler is not None:
+            for obj, name, stage in ((source, 'read', 'decode'),
+                                     (detector, 'detect', 'detect'),
+                                     (detector, 'detect_batch', 'detect'),
+                                     (tracker, 'track', 'track'),
+                                     (visualiser, 'act', 'visualise'),
+                                     (results_writer, 'act', 'results')):
+                if obj is not None and hasattr(obj, name):
+                    profiler.instrument(obj=obj, name=name, stage=stage)
+
+        status = True
+        while status:
+            frame_ids, frames = _read_frames(source=source, num=args['batch_size'])
+            if not frames:
+                break
+            # Drop frames, which are too old to be presented in time already, e.g. delivered in a burst after a stall
+            if live and max_latency_s < time.perf_counter() - source.get_last_captured_at():
+                registry.increment(label='dropped_frames_late')
+                continue
+
+            # Detect objects at all the frames at once, if batching is requested, otherwise let the tracker decide
+            detections_per_frame = [None, ] * len(frames)
+            if detection_cache is not None:
+                detection_cache.set_frame_ids(frame_ids=frame_ids)
+            if 1 < args['batch_size']:
+                detections_per_frame = detector.detect_batch(frames=frames, roi=args['roi'])
+
+            for frame_id, frame, detections in zip(frame_ids, frames, detections_per_frame):
+                if detection_cache is not None:
+                    detection_cache.set_frame_ids(frame_ids=[frame_id, ])
+                done_ids, est_ids = tracker.track(frame=frame, detections=detections)
+                if results_writer is not None:
+                    results_writer.act(frame_id=frame_id, done_ids=done_ids, est_ids=est_ids, tracker=tracker)
+                if live:
+                    # Results are kept for every tracked frame, while frames late to present are skipped
+                    latency_s = time.perf_counter() - source.get_last_captured_at()
+                    if max_latency_s < latency_s:
+                        registry.increment(label='late_outputs_skipped')
+                        visualiser.forget(done_ids=done_ids)
+                    else:
+                        status = visualiser.act(frame=frame, done_ids=done_ids, est_ids=est_ids, tracker=tracker)
+                        latency_s = time.perf_counter() - source.get_last_captured_at()
+                        registry.record(label='capture_to_output', ns=int(latency_s * 1e9))
+                else:
+                    status = visualiser.act(frame=frame, done_ids=done_ids, est_ids=est_ids, tracker=tracker)
+                frames_num += 1
+                registry.increment(label='frames')
+                if 1 == frames_num:
+                    _report_startup(logger=logger, registry=registry, start=start)
+                if profiler is not None:
+                    profiler.on_frame(frames_num=frames_num)
+                if not status:
+                    break
+    finally:
+        if tracker is not None:
+            tracker.close()
+        if profiler is not None:
+            profiler.close()
+        if visualiser is not None:
+            visualiser.close()
+        if results_writer is not None:
+            results_writer.close()
+        if detection_cache is not None:
+            detection_cache.close()
+        if source is not None:
+            source.release()
+        summary = registry.stop_dumping() if registry.is_enabled() else None
+
+    if summary is not None:
+        logger.info(f'Report metrics: {json.dumps(summary)}')
+        logger.info(f'Store metrics at {metrics_path}')
+        _report_striding(logger=logger, settings=settings, summary=summary)
+        if live:
+            _report_live(logger=logger, args=args, source=source, summary=summary)
+
+    return frames_num
+
+
+def _collect_videos(args):
+    """
+    Expands video paths and patterns, assigns every video a distinct output folder
+    """
+    video_paths = []
+    for pattern in args['videos']:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern, ]
+        video_paths.extend(p for p in matches if p not in video_paths)
+
+    jobs, names = [], set()
+    for i, video_path in enumerate(video_paths):
+        name = os.path.splitext(os.path.basename(os.path.normpath(video_path)))[0]
+        if name in names:
+            name = f'{name}_{i}'
+        names.add(name)
+        jobs.append({'video_path': video_path, 'output_root': os.path.join(args['output_root'], name)})
+
+    return jobs
+
+
+# A state of a worker process, which is kept across videos
+_worker = {}
+
+
+def _init_worker(args, settings, workers):
+    """
+    Establishes logging and the detector once per a worker process, file logging is set up per video
+    """
+    logger = _setup_logging(args=args, fmt='%(asctime)s [%(levelname)s] [%(processName)s] %(message)s',
+                            file_logging=False)
+    _ped_trk.metrics.get_registry().enable(enabled='on' == args['metrics'])
+    _budget_threads(args=args, logger=logger, workers=workers)
+    _worker.update({
+        'args': args,
+        'settings': settings,
+        'logger': logger,
+        'detector': _create_detector(args=args, logger=logger, settings=settings)
+    })
+
+
+def _track_video_in_worker(job):
+    """
+    """
+    args = dict(_worker['args'], **job)
+    logger = _worker['logger']
+
     _secure_output_root(args=args)
-    logger = _setup_logging(args=args)
+    file = _add_file_logging(args=args, logger=logger, formatter=logger.handlers[0].formatter)
+    stats = {'video_path': args['video_path'], 'worker': multiprocessing.current_process().name}
+    start = time.perf_counter()
+    try:
+        stats['frames_num'] = _track_video(args=args, logger=logger, settings=_worker['settings'],
+                                           detector=_worker['detector'])
+    except Exception as e:
+        logger.error(f'Fail to track objects at {args["video_path"]}: {e}')
+        stats['frames_num'] = 0
+        stats['error'] = str(e)
+    finally:
+        stats['elapsed_s'] = time.perf_counter() - start
+        logger.removeHandler(hdlr=file)
+        file.close()
 
-    settings = json.load(fp=open(file=args['settings_file_path']))
-    tracker = _create_tracker(args=args, logger=logger, settings=settings)
+    return stats
 
-    reader = _create_frames_reader(args=args)
-    visualiser = create_visualizer(logger=logger, args=args, reader=reader)
 
-    status = True
-    while status:
-        status, frame = reader.read()
-        if not status:
-            continue
+def _track_videos(args, logger, settings):
+    """
+    Spreads a batch of videos over a pool of worker processes and reports the aggregate throughput
+    """
+    jobs = _collect_videos(args=args)
+    workers = max(1, min(args['workers'], len(jobs)))
+    logger.info(f'Track objects at a batch of videos: {{'
+                f'"videos_num": {len(jobs)}, '
+                f'"workers": {workers}'
+                f'}}')
+
+    start = time.perf_counter()
+    stats_per_video = []
+    # Spawn workers to not inherit threads of OpenCV, which fork doesn't get along with
+    context = multiprocessing.get_context(method='spawn')
+    with context.Pool(processes=workers, initializer=_init_worker, initargs=(args, settings, workers)) as pool:
+        for stats in pool.imap_unordered(_track_video_in_worker, jobs, chunksize=1):
+            logger.info(f'Track objects at a video: {json.dumps(stats)}')
+            stats_per_video.append(stats)
+    elapsed_s = time.perf_counter() - start
+
+    # Aggregate the throughput per worker and overall
+    report_per_worker = {}
+    for stats in stats_per_video:
+        report = report_per_worker.setdefault(stats['worker'], {'videos_num': 0, 'frames_num': 0, 'elapsed_s': 0.})
+        report['videos_num'] += 1
+        report['frames_num'] += stats['frames_num']
+        report['elapsed_s'] += stats['elapsed_s']
+    for report in report_per_worker.values():
+        report['fps'] = report['frames_num'] / report['elapsed_s'] if report['elapsed_s'] else 0.
+
+    frames_num = sum(s['frames_num'] for s in stats_per_video)
+    report = {
+        'videos_num': len(stats_per_video),
+        'failed_videos': [s['video_path'] for s in stats_per_video if 'error' in s],
+        'frames_num': frames_num,
+        'elapsed_s': elapsed_s,
+        'fps': frames_num / elapsed_s if elapsed_s else 0.,
+        'workers': report_per_worker,
+        'videos': sorted(stats_per_video, key=lambda s: s['video_path'])
+    }
+    report_path = os.path.abspath(os.path.join(args['output_root'], 'batch_report.json'))
+    json.dump(obj=report, fp=open(file=report_path, mode='w'), indent=2)
+    logger.info(f'Report the batch throughput: {{'
+                f'"videos_num": {report["videos_num"]}, '
+                f'"frames_num": {frames_num}, '
+                f'"fps": {report["fps"]:.2f}, '
+                f'"fps_per_worker": {json.dumps({w: round(r["fps"], 2) for w, r in report_per_worker.items()})}, '
+                f'"path": "{report_path}"'
+                f'}}')
+
+    return report
 
-        done_ids, est_ids = tracker.track(frame=frame)
-        status = visualiser.act(frame=frame, done_ids=done_ids, est_ids=est_ids, tracker=tracker)
 
-    reader.release()
+if __name__ == '__main__':
+    args = _collect_arguments()
+    _secure_output_root(args=args)
+    logger = _setup_logging(args=args)
+
+    settings = json.load(fp=open(file=args['settings_file_path']))
+    _ped_trk.metrics.get_registry().enable(enabled='on' == args['metrics'])
+    if args['detection_cache'] is not None and 'all' == args['detection_cache_invalidate']:
+        import _ped_trk.detection_cache
+        _ped_trk.detection_cache.purge(logger=logger, folder_path=args['detection_cache'])
+    if args['videos']:
+        _track_videos(args=args, logger=logger, settings=settings)
+    else:
+        _budget_threads(args=args, logger=logger)
+        detector = _create_detector(args=args, logger=logger, settings=settings)
+        _track_video(args=args, logger=logger, settings=settings, detector=detector)
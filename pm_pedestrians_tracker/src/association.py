@@ -0,0 +1,135 @@
+import numpy as np
+
+# A cost of a pair that doesn't pass the IoU gate, it's big enough to never be preferred to a legit pair
+_GATED_COST = 1e6
+
+
+def iou_matrix(rects_a, rects_b):
+    """
+    Computes IoU for every pair of left-top-width-height rectangles at once
+    """
+    rects_a = np.asarray(rects_a, dtype=np.float64).reshape(-1, 4)
+    rects_b = np.asarray(rects_b, dtype=np.float64).reshape(-1, 4)
+
+    l_a, t_a, w_a, h_a = (rects_a[:, i, np.newaxis] for i in range(4))
+    l_b, t_b, w_b, h_b = (rects_b[np.newaxis, :, i] for i in range(4))
+
+    i_w = np.clip(np.minimum(l_a + w_a, l_b + w_b) - np.maximum(l_a, l_b), a_min=0, a_max=None)
+    i_h = np.clip(np.minimum(t_a + h_a, t_b + h_b) - np.maximum(t_a, t_b), a_min=0, a_max=None)
+    i_area = i_w * i_h
+    u_area = w_a * h_a + w_b * h_b - i_area
+
+    ious = np.divide(i_area, u_area, out=np.zeros_like(i_area), where=0 < u_area)
+    return ious
+
+
+def _solve_min_cost(cost):
+    """
+    Assigns every row to a distinct column with the minimal total cost, requires rows not to outnumber columns.
+    Follows the shortest augmenting path flavour of the Hungarian algorithm, O(n^2 * m)
+    """
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    # Rows and columns are 1-based here, 0 stands for a virtual column/row
+    row_per_col = np.zeros(m + 1, dtype=np.int64)
+    way = np.zeros(m + 1, dtype=np.int64)
+
+    for i in range(1, n + 1):
+        row_per_col[0] = i
+        j0 = 0
+        min_v = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = row_per_col[j0]
+
+            # Relax reduced costs of all the free columns at once
+            free = ~used[1:]
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            improved = free & (reduced < min_v[1:])
+            min_v[1:][improved] = reduced[improved]
+            way[1:][improved] = j0
+
+            candidates = np.where(free, min_v[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+
+            # Shift potentials
+            used_cols = np.flatnonzero(used)
+            u[row_per_col[used_cols]] += delta
+            v[used_cols] -= delta
+            min_v[1:][free] -= delta
+
+            j0 = j1
+            if 0 == row_per_col[j0]:
+                break
+
+        # Flip the augmenting path
+        while j0:
+            j1 = way[j0]
+            row_per_col[j0] = row_per_col[j1]
+            j0 = j1
+
+    cols = np.flatnonzero(row_per_col[1:]) + 1
+    return row_per_col[cols] - 1, cols - 1
+
+
+def associate_hungarian(ious, iou_threshold):
+    """
+    Finds pairs of rows and columns with the maximal total IoU among the ones passing the threshold
+    """
+    if 0 == ious.size:
+        return []
+
+    # Leave out rows and columns that have no chance to be paired, since crowded scenes are sparse
+    gated = ious < iou_threshold
+    row_ids = np.flatnonzero(~gated.all(axis=1))
+    col_ids = np.flatnonzero(~gated.all(axis=0))
+    if 0 == row_ids.size:
+        return []
+
+    gated = gated[np.ix_(row_ids, col_ids)]
+    cost = np.where(gated, _GATED_COST, 1. - ious[np.ix_(row_ids, col_ids)])
+
+    transposed = cost.shape[1] < cost.shape[0]
+    rows, cols = _solve_min_cost(cost=cost.T if transposed else cost)
+    if transposed:
+        rows, cols = cols, rows
+
+    pairs = sorted((int(row_ids[r]), int(col_ids[c])) for r, c in zip(rows, cols) if not gated[r, c])
+    return pairs
+
+
+def associate_greedy(ious, iou_threshold):
+    """
+    Picks pairs of rows and columns passing the threshold in the descending IoU order
+    """
+    if 0 == ious.size:
+        return []
+
+    rows, cols = np.nonzero(iou_threshold <= ious)
+    order = np.argsort(-ious[rows, cols], kind='stable')
+
+    pairs = []
+    used_rows, used_cols = set(), set()
+    for r, c in zip(rows[order].tolist(), cols[order].tolist()):
+        if r in used_rows or c in used_cols:
+            continue
+
+        used_rows.add(r)
+        used_cols.add(c)
+        pairs.append((r, c))
+
+    return sorted(pairs)
+
+
+def get_associator(strategy):
+    """
+    """
+    associator_per_id = {
+        'hungarian': associate_hungarian,
+        'greedy': associate_greedy
+    }
+
+    return associator_per_id[strategy]
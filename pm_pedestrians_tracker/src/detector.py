@@ -1,39 +1,274 @@
+import fractions
+import math
+import os
+import time
+
 import cv2
 import numpy as np
 
+import _ped_trk.metrics
 import _ped_trk.timer
 
 
+# Parsed models and label indices per file, so detectors established again in a process, e.g. per video or per
+# benchmark, don't parse the same files and initialise the backend again
+_model_per_key = {}
+_class_id_per_key = {}
+
+# Backends and targets of OpenCV DNN by names of settings, in the order of preference for auto-detection
+_BACKENDS = {
+    'cuda': cv2.dnn.DNN_BACKEND_CUDA,
+    'inference_engine': cv2.dnn.DNN_BACKEND_INFERENCE_ENGINE,
+    'opencv': cv2.dnn.DNN_BACKEND_OPENCV
+}
+_TARGETS = {
+    'cuda': cv2.dnn.DNN_TARGET_CUDA,
+    'cuda_fp16': cv2.dnn.DNN_TARGET_CUDA_FP16,
+    'cpu': cv2.dnn.DNN_TARGET_CPU,
+    'opencl': cv2.dnn.DNN_TARGET_OPENCL,
+    'opencl_fp16': cv2.dnn.DNN_TARGET_OPENCL_FP16
+}
+
+
+def _get_file_key(path):
+    """
+    Identifies a file by its path and version, so an updated file is read again
+    """
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+
+def _is_available(backend, target):
+    """
+    Checks whether OpenCV is built with a backend-target pair, and whether there is a device for CUDA
+    """
+    if target not in _TARGETS or _TARGETS[target] not in cv2.dnn.getAvailableTargets(be=_BACKENDS[backend]):
+        return False
+    if 'cuda' == backend:
+        return hasattr(cv2, 'cuda') and 0 < cv2.cuda.getCudaEnabledDeviceCount()
+
+    return True
+
+
+def _resolve_backend(logger, backend, target):
+    """
+    Returns the most preferred available backend-target pair matching settings, either of which may be auto.
+    OpenCV DNN falls back to its own CPU implementation silently, so a fallback is logged explicitly
+    """
+    pairs = [(b, t) for b in _BACKENDS for t in _TARGETS if _is_available(backend=b, target=t)]
+    matching = [(b, t) for b, t in pairs if backend in ('auto', b) and target in ('auto', t)]
+    if matching:
+        resolved = matching[0]
+        logger.info(f'Detect a DNN backend: {{"backend": "{resolved[0]}", "target": "{resolved[1]}"}}')
+    else:
+        resolved = pairs[0] if pairs else ('opencv', 'cpu')
+        logger.warning(f'Fall back from an unavailable DNN backend: {{'
+                       f'"requested": ["{backend}", "{target}"], '
+                       f'"resolved": ["{resolved[0]}", "{resolved[1]}"]'
+                       f'}}')
+
+    return resolved
+
+
+def _get_model(weights_file_path, backend, target):
+    """
+    Returns a parsed model with names of its output layers, models are parsed once per process and backend
+    """
+    key = _get_file_key(path=weights_file_path) + (backend, target)
+    if key not in _model_per_key:
+        model = cv2.dnn.readNetFromONNX(onnxFile=weights_file_path)
+        model.setPreferableBackend(backendId=_BACKENDS[backend])
+        model.setPreferableTarget(targetId=_TARGETS[target])
+        layer_names = model.getLayerNames()
+        output_layers = [layer_names[ol - 1] for ol in model.getUnconnectedOutLayers()]
+        _model_per_key[key] = model, output_layers
+
+    return _model_per_key[key]
+
+
+def _get_class_id(labels_file_path, class_label):
+    """
+    Returns an index of a label in a file of labels, files are read once per process
+    """
+    key = _get_file_key(path=labels_file_path) + (class_label,)
+    if key not in _class_id_per_key:
+        labels = open(file=labels_file_path).read().rstrip('\n').split(sep='\n')
+        _class_id_per_key[key] = labels.index(class_label)
+
+    return _class_id_per_key[key]
+
+
+class _Letterboxer:
+    """
+    Fits images into the blob size keeping their aspect ratio, and converts them to an NCHW float blob.
+    All the buffers are preallocated and filled in place, they are reallocated only when a layout changes
+    """
+
+    def __init__(self, size, scale_factor, mean, swap_rb, color):
+        """
+        """
+        self.__size = size
+        self.__scale_factor = scale_factor
+        self.__mean = tuple(mean) + (0,) * (3 - len(mean))
+        # Map blob channels to image ones
+        self.__channels = (2, 1, 0) if swap_rb else (0, 1, 2)
+        self.__pad_values = [(color[ch] - self.__mean[c]) * scale_factor for c, ch in enumerate(self.__channels)]
+
+        blob_w, blob_h = size
+        self.__blob = np.empty(shape=(0, 3, blob_h, blob_w), dtype=np.float32)
+        self.__layout_per_item = []
+        self.__resized_per_size = {}
+
+    def __get_layout(self, image):
+        """
+        Computes a size of a resized image, a scale and a padding to fit it into the blob
+        """
+        blob_w, blob_h = self.__size
+        image_h, image_w = image.shape[:2]
+        scale = min(blob_w / image_w, blob_h / image_h)
+        resized_w, resized_h = min(blob_w, round(image_w * scale)), min(blob_h, round(image_h * scale))
+        pad_x, pad_y = (blob_w - resized_w) // 2, (blob_h - resized_h) // 2
+
+        return (resized_w, resized_h), scale, (pad_x, pad_y)
+
+    def __get_resized(self, size):
+        """
+        """
+        if size not in self.__resized_per_size:
+            resized_w, resized_h = size
+            self.__resized_per_size[size] = np.empty(shape=(resized_h, resized_w, 3), dtype=np.uint8)
+
+        return self.__resized_per_size[size]
+
+    def __reserve(self, items_num):
+        """
+        """
+        if self.__blob.shape[0] != items_num:
+            self.__blob = np.empty(shape=(items_num,) + self.__blob.shape[1:], dtype=np.float32)
+            self.__layout_per_item = [None, ] * items_num
+
+    def process(self, images):
+        """
+        Fills the blob with images, returns the blob and scales with paddings of the images
+        """
+        self.__reserve(items_num=len(images))
+
+        geometries = []
+        for i, image in enumerate(images):
+            layout = self.__get_layout(image=image)
+            (resized_w, resized_h), scale, (pad_x, pad_y) = layout
+
+            # Paint the padding only when the layout changes, the rest of the blob is always overwritten
+            if layout != self.__layout_per_item[i]:
+                for c, pad_value in enumerate(self.__pad_values):
+                    self.__blob[i, c].fill(pad_value)
+                self.__layout_per_item[i] = layout
+
+            resized = image
+            if image.shape[1::-1] != (resized_w, resized_h):
+                resized = self.__get_resized(size=(resized_w, resized_h))
+                cv2.resize(src=image, dsize=(resized_w, resized_h), dst=resized, interpolation=cv2.INTER_LINEAR)
+
+            # Convert to float, subtract the mean and scale right at the blob
+            for c, ch in enumerate(self.__channels):
+                area = self.__blob[i, c, pad_y:pad_y + resized_h, pad_x:pad_x + resized_w]
+                np.subtract(resized[:, :, ch], self.__mean[c], out=area, dtype=np.float32, casting='unsafe')
+                np.multiply(area, self.__scale_factor, out=area, dtype=np.float32, casting='unsafe')
+
+            geometries.append((scale, (pad_x, pad_y)))
+
+        return self.__blob, geometries
+
+
+class _Tiler:
+    """
+    Cuts images into overlapping tiles, so small objects aren't squeezed away by fitting a whole image into the blob.
+    Tiles are views of images, grids are computed once per image size
+    """
+    # A factor to grow tiles by, until a grid fits the budget
+    _GROWTH = 1.1
+
+    def __init__(self, size, overlap, max_tiles, full_frame):
+        """
+        A size is a width-height tuple of a tile at the frame scale, an overlap is a fraction of it.
+        The whole image is added as a tile of its own, if requested, to keep objects larger than the overlap intact
+        """
+        self.__size = size
+        self.__overlap = overlap
+        self.__max_tiles = max_tiles
+        self.__full_frame = full_frame
+        self.__grid_per_size = {}
+
+    def __get_starts(self, extent, tile):
+        """
+        Spreads tiles evenly over an extent, the first and the last ones are aligned with its borders
+        """
+        if extent <= tile:
+            return [0, ]
+
+        num = math.ceil((extent - tile) / (tile * (1. - self.__overlap))) + 1
+        return [round(i * (extent - tile) / (num - 1)) for i in range(num)]
+
+    def __get_grid(self, image_w, image_h):
+        """
+        Returns left-top-width-height tiles of an image, grown until their number fits the budget
+        """
+        if (image_w, image_h) not in self.__grid_per_size:
+            budget = max(1, self.__max_tiles - self.__full_frame)
+            tile_w, tile_h = self.__size
+            while True:
+                w, h = min(image_w, round(tile_w)), min(image_h, round(tile_h))
+                grid = [(l, t, w, h) for t in self.__get_starts(extent=image_h, tile=h)
+                        for l in self.__get_starts(extent=image_w, tile=w)]
+                if len(grid) <= budget:
+                    break
+                tile_w, tile_h = tile_w * self._GROWTH, tile_h * self._GROWTH
+
+            if self.__full_frame and 1 < len(grid):
+                grid.insert(0, (0, 0, image_w, image_h))
+            self.__grid_per_size[(image_w, image_h)] = grid
+
+        return self.__grid_per_size[(image_w, image_h)]
+
+    def cut(self, image):
+        """
+        Returns tiles of an image with their left-top corners
+        """
+        image_h, image_w = image.shape[:2]
+        return [(image[t:t + h, l:l + w], (l, t)) for l, t, w, h in self.__get_grid(image_w=image_w, image_h=image_h)]
+
+
 class Detector(_ped_trk.timer.Timeable):
     """
     """
+    _LETTERBOX_COLOR = (114, 114, 114)
 
     def __init__(self, logger, settings):
         """
-        Sets up a model to infer with
+        Sets up a model to infer with, and warms it up, so the first frame doesn't pay for lazy initialisation
         """
         super().__init__(logger=logger)
+        start = time.perf_counter()
 
-        # Read pre-processing params
+        # Read pre-processing params, the scale factor is a number or a fraction, e.g. "1/255"
         self.__pre_processing_params = {
-            'scalefactor': eval(settings['scale_factor']),
+            'scalefactor': float(fractions.Fraction(str(settings['scale_factor']))),
             'size': tuple(settings['size']),
             'mean': tuple(settings['mean']),
             'swapRB': settings['swap_rb'],
             'crop': settings['crop']
         }
 
-        # Establish the model
-        self.__model = cv2.dnn.readNetFromONNX(onnxFile=settings['weights_file_path'])
-        self.__model.setPreferableBackend(backendId=cv2.dnn.DNN_BACKEND_CUDA)
-        self.__model.setPreferableTarget(targetId=cv2.dnn.DNN_TARGET_CUDA)
-        layer_names = self.__model.getLayerNames()
-        self.__output_layers = [layer_names[ol - 1] for ol in self.__model.getUnconnectedOutLayers()]
+        # Establish the model, FP16 and INT8-quantized variants are loaded just like the FP32 one
+        self.__backend, self.__target = _resolve_backend(logger=logger, backend=settings['backend'],
+                                                         target=settings['target'])
+        self.__model, self.__output_layers = _get_model(weights_file_path=settings['weights_file_path'],
+                                                        backend=self.__backend, target=self.__target)
 
         # Read post-processing params
         self.__confidence_threshold = settings['confidence_threshold']
-        labels = open(file=settings['labels_file_path']).read().rstrip('\n').split(sep='\n')
-        self.__class_id = labels.index(settings['class_label'])
+        self.__class_id = _get_class_id(labels_file_path=settings['labels_file_path'],
+                                        class_label=settings['class_label'])
         self.__post_processing_params = {
             'score_threshold': settings['score_threshold'],
             'nms_threshold': settings['nms_threshold'],
@@ -41,51 +276,229 @@ class Detector(_ped_trk.timer.Timeable):
             'top_k': settings['top_k']
         }
 
-    def _pre_process(self, frame):
+        # Read ROI params
+        self.__roi_crop = settings['roi_crop']
+        self.__roi_margin = settings['roi_margin']
+
+        # Establish pre-processing buffers, if letterboxing is requested. ROI crops are letterboxed always, since their
+        # aspect ratio is arbitrary, the switch tells about whole frames only
+        self.__letterbox = settings['letterbox']
+        self.__letterboxer = None
+        if self.__letterbox or self.__roi_crop:
+            self.__letterboxer = _Letterboxer(size=self.__pre_processing_params['size'],
+                                              scale_factor=self.__pre_processing_params['scalefactor'],
+                                              mean=self.__pre_processing_params['mean'],
+                                              swap_rb=self.__pre_processing_params['swapRB'],
+                                              color=self._LETTERBOX_COLOR)
+
+        # Establish tiling, if it's requested
+        self.__tiler = None
+        if settings['tiling']['enabled']:
+            self.__tiler = _Tiler(size=tuple(settings['tiling']['size']), overlap=settings['tiling']['overlap'],
+                                  max_tiles=settings['tiling']['max_tiles'],
+                                  full_frame=settings['tiling']['full_frame'])
+        load_s = time.perf_counter() - start
+
+        # Tiles of a frame and a batched warm-up for them are inferred with a single forward pass, which a model
+        # exported with a fixed batch dimension fails or mixes up
+        if (self.__tiler is not None or 1 < settings['warm_up']['batch_size']) and not self.__accepts_batches():
+            raise ValueError(f'Tiling and a batched warm-up require a model with a dynamic batch dimension, '
+                             f'the one at {settings["weights_file_path"]} has a fixed one')
+        warm_up_s = self.__warm_up(runs=settings['warm_up']['runs'], batch_size=settings['warm_up']['batch_size'])
+        self.get_logger().info(f'Establish the detector: {{'
+                               f'"weights_file_path": "{settings["weights_file_path"]}", '
+                               f'"backend": "{self.__backend}", '
+                               f'"target": "{self.__target}", '
+                               f'"load_s": {load_s:.3f}, '
+                               f'"warm_up_s": {warm_up_s:.3f}'
+                               f'}}')
+
+    def __accepts_batches(self):
         """
+        Checks, whether the model infers a blob of several images at once
         """
-        blob = cv2.dnn.blobFromImage(image=frame, **self.__pre_processing_params)
-        return blob
+        blob_w, blob_h = self.__pre_processing_params['size']
+        self.__model.setInput(blob=np.zeros(shape=(2, 3, blob_h, blob_w), dtype=np.float32))
+        try:
+            outputs = self.__model.forward(outBlobNames=self.__output_layers)
+        except cv2.error:
+            return False
 
-    @_ped_trk.timer.timer(label='obj_det')
-    def detect(self, frame):
+        return all(2 == output.shape[0] for output in outputs)
+
+    def __warm_up(self, runs, batch_size):
         """
+        Runs forward passes for a blank blob of a batch size, so the backend allocates and tunes its layers
+        before the first real frame. Returns elapsed time in seconds
         """
-        blob = self._pre_process(frame=frame)
+        start = time.perf_counter()
+        blob_w, blob_h = self.__pre_processing_params['size']
+        blob = np.zeros(shape=(batch_size, 3, blob_h, blob_w), dtype=np.float32)
+        for _ in range(runs):
+            self.__model.setInput(blob=blob)
+            self.__model.forward(outBlobNames=self.__output_layers)
 
-        self.__model.setInput(blob=blob)
-        ([objects, ],) = self.__model.forward(outBlobNames=self.__output_layers)
+        return time.perf_counter() - start
+
+    def _pre_process(self, frame, roi=None):
+        """
+        Builds a blob of a frame, returns it with a transform to map boxes from the blob back to the frame
+        """
+        blob, [transform, ] = self._pre_process_batch(frames=[frame, ], roi=roi)
+        return blob, transform
+
+    def _pre_process_batch(self, frames, roi=None):
+        """
+        Builds a blob of frames, returns it with transforms to map boxes from the blob back to every frame
+        """
+        images, corners = zip(*[self.__crop(frame=frame, roi=roi) for frame in frames])
+        return self.__to_blob(images=images, corners=corners, letterbox=self.__is_letterboxed(roi=roi))
+
+    def __is_letterboxed(self, roi):
+        """
+        Tells whether images cut out of frames with a ROI are letterboxed
+        """
+        return self.__letterbox or self.__roi_crop and roi is not None
+
+    def __to_blob(self, images, corners, letterbox):
+        """
+        Builds a blob of images, returns it with transforms to map boxes from the blob back to frames,
+        which the images are cut out of at the corners. Images are stretched to the blob size, unless letterboxed
+        """
+        if not letterbox:
+            # Stretch images to the blob size
+            blob = cv2.dnn.blobFromImages(images=images, **self.__pre_processing_params)
+            blob_w, blob_h = self.__pre_processing_params['size']
+            transforms = [{'coeff_h': image.shape[0] / blob_h, 'coeff_w': image.shape[1] / blob_w,
+                           'offset_x': c_l, 'offset_y': c_t}
+                          for image, (c_l, c_t) in zip(images, corners)]
+            return blob, transforms
+
+        blob, geometries = self.__letterboxer.process(images=images)
+        transforms = [{'coeff_h': 1 / scale, 'coeff_w': 1 / scale,
+                       'offset_x': c_l - pad_x / scale, 'offset_y': c_t - pad_y / scale}
+                      for (scale, (pad_x, pad_y)), (c_l, c_t) in zip(geometries, corners)]
+        return blob, transforms
+
+    def __crop(self, frame, roi):
+        """
+        Cuts the ROI extended with the margin out of a frame, if the ROI crop is enabled.
+        Returns the crop and its left-top corner
+        """
+        if not self.__roi_crop or roi is None:
+            return frame, (0, 0)
 
         frame_h, frame_w = frame.shape[:2]
-        blob_h, blob_w = self.__pre_processing_params['size']
-        coeff_h, coeff_w = frame_h / blob_h, frame_w / blob_w
-        class_objs = self._post_process(objects=objects, coeff_h=coeff_h, coeff_w=coeff_w)
+        l, t, w, h = roi
+        c_l, c_t = max(0, l - self.__roi_margin), max(0, t - self.__roi_margin)
+        c_r, c_b = min(frame_w, l + w + 1 + self.__roi_margin), min(frame_h, t + h + 1 + self.__roi_margin)
+        return frame[c_t:c_b, c_l:c_r], (c_l, c_t)
+
+    def __forward(self, blob):
+        """
+        """
+        self.__model.setInput(blob=blob)
+        (objects_per_item,) = self.__model.forward(outBlobNames=self.__output_layers)
+        return objects_per_item
+
+    def __infer(self, blob, transforms):
+        """
+        Runs a single forward pass for a blob of frames and splits its outputs per frame
+        """
+        objects_per_frame = self.__forward(blob=blob)
+
+        class_objs_per_frame = [self._post_process(objects=objects, **transform)
+                                for objects, transform in zip(objects_per_frame, transforms)]
+        return class_objs_per_frame
+
+    def __detect_tiled(self, frames, roi):
+        """
+        Cuts frames into tiles and infers all of them with a single forward pass.
+        The model has to be exported with a dynamic or matching batch dimension
+        """
+        images, corners, frame_ids = [], [], []
+        for frame_id, frame in enumerate(frames):
+            image, (c_l, c_t) = self.__crop(frame=frame, roi=roi)
+            for tile, (l, t) in self.__tiler.cut(image=image):
+                images.append(tile)
+                corners.append((c_l + l, c_t + t))
+                frame_ids.append(frame_id)
+        _ped_trk.metrics.get_registry().increment(label='detection_tiles', num=len(images))
+
+        blob, transforms = self.__to_blob(images=images, corners=corners, letterbox=self.__is_letterboxed(roi=roi))
+        objects_per_tile = self.__forward(blob=blob)
+
+        tiles_per_frame = [[] for _ in frames]
+        for frame_id, objects, transform in zip(frame_ids, objects_per_tile, transforms):
+            tiles_per_frame[frame_id].append((objects, transform))
+        class_objs_per_frame = [self._post_process_tiles(tiles=tiles) for tiles in tiles_per_frame]
+
+        return class_objs_per_frame
+
+    @_ped_trk.timer.timer(label='obj_det')
+    def detect(self, frame, roi=None):
+        """
+        Detects objects at a frame, only the ROI with a margin is inferred, if the ROI crop is enabled
+        """
+        if self.__tiler is not None:
+            [class_objs, ] = self.__detect_tiled(frames=[frame, ], roi=roi)
+            return class_objs
+
+        blob, transform = self._pre_process(frame=frame, roi=roi)
+        [class_objs, ] = self.__infer(blob=blob, transforms=[transform, ])
 
         return class_objs
 
-    def _post_process(self, objects, coeff_h, coeff_w):
+    @_ped_trk.timer.timer(label='obj_det_post_processing')
+    def _post_process(self, objects, coeff_h, coeff_w, offset_x=0., offset_y=0.):
         """
+        Filters and suppresses raw model outputs at once, without walking them row by row.
+        Boxes are mapped to the frame as scaled by the coefficients and shifted by the offsets
+        """
+        boxes, scores = self.__filter(objects=objects, coeff_h=coeff_h, coeff_w=coeff_w, offset_x=offset_x,
+                                      offset_y=offset_y)
+        return self.__suppress(boxes=boxes, scores=scores)
+
+    @_ped_trk.timer.timer(label='obj_det_post_processing')
+    def _post_process_tiles(self, tiles):
+        """
+        Filters raw model outputs of every tile of a frame, and suppresses their boxes together in frame coordinates,
+        so objects at overlaps of tiles are reported once
+        """
+        boxes_per_tile, scores_per_tile = zip(*[self.__filter(objects=objects, **transform)
+                                                for objects, transform in tiles])
+        return self.__suppress(boxes=np.concatenate(boxes_per_tile), scores=np.concatenate(scores_per_tile))
+
+    def __filter(self, objects, coeff_h, coeff_w, offset_x, offset_y):
+        """
+        Keeps confident objects of the class, returns their left-top-width-height boxes at the frame with scores
         """
         # Discard unconfident detections
-        objects = [o for o in objects if self.__confidence_threshold < o[4]]
+        objects = objects[self.__confidence_threshold < objects[:, 4]]
 
-        # Discard objects that don't belong to the class
-        objects = [o for o in objects if self.__class_id == np.argmax(a=o[5:])]
+        # Discard objects that don't belong to the class or have low score for it
+        class_scores = objects[:, 5:]
+        mask = self.__class_id == np.argmax(a=class_scores, axis=1)
+        mask &= self.__post_processing_params['score_threshold'] < class_scores[:, self.__class_id]
+        objects = objects[mask]
 
-        # Discard the class objects with low score
-        objects = [o for o in objects if self.__post_processing_params['score_threshold'] < o[5:][self.__class_id]]
+        # Convert centered boxes to left-top ones at the frame scale
+        coeffs = np.array([coeff_w, coeff_h], dtype=np.float64)
+        offsets = np.array([offset_x, offset_y], dtype=np.float64)
+        wh = np.trunc(objects[:, 2:4] * coeffs)
+        lt = np.trunc(objects[:, :2] * coeffs + offsets - wh / 2)
+        boxes = np.concatenate((lt, wh), axis=1).astype(np.int32)
+        scores = objects[:, 4].astype(np.float32)
 
+        return boxes, scores
+
+    def __suppress(self, boxes, scores):
+        """
+        """
         # Suppress non-maximal detections of the class
-        boxes = []
-        for obj in objects:
-            c_x, c_y, w, h = obj[:4]
-            width = int(w * coeff_w)
-            height = int(h * coeff_h)
-            left = int(c_x * coeff_w - width / 2)
-            top = int(c_y * coeff_h - height / 2)
-            boxes.append((left, top, width, height))
-        scores = [float(o[4]) for o in objects]
         max_box_ids = cv2.dnn.NMSBoxes(bboxes=boxes, scores=scores, **self.__post_processing_params)
+        max_box_ids = np.asarray(max_box_ids, dtype=np.int64).reshape(-1)
 
-        class_objs = [{'lt_wh': boxes[bi], 'score': scores[bi]} for bi in max_box_ids]
+        class_objs = [{'lt_wh': tuple(b), 'score': s}
+                      for b, s in zip(boxes[max_box_ids].tolist(), scores[max_box_ids].tolist())]
         return class_objs
@@ -0,0 +1,171 @@
+import numpy as np
+
+
+class PeriodicScheduler:
+    """
+    Re-detects objects at a fixed period, and whenever some track is lost
+    """
+
+    def __init__(self, re_detect_every):
+        """
+        """
+        if re_detect_every < 1:
+            raise ValueError(f'Re-detection period must be positive, got {re_detect_every}')
+
+        self.__re_detect_every = re_detect_every
+        # A frame the period is due at, it fires at the first frame seen since, so strided frames don't skip it
+        self.__due_frame_id = re_detect_every
+
+    def __str__(self):
+        return f'{{"strategy": "periodic", "re_detect_every": {self.__re_detect_every}}}'
+
+    def decide(self, frame_id, tracks, failed_ids, stick_out_ids):
+        """
+        Tells whether to re-detect objects at a frame, and why. Nothing is committed till the detection happens
+        """
+        if failed_ids:
+            return True, 'extend_failure'
+        if stick_out_ids:
+            return True, 'left_roi'
+        if self.__due_frame_id <= frame_id:
+            return True, 'period'
+
+        return False, 'steady'
+
+    def on_detection(self, frame_id):
+        """
+        Commits a detection at a frame, it serves the period, if the one is due
+        """
+        if self.__due_frame_id <= frame_id:
+            # Keep the schedule aligned with multiples of the period, however late it fires
+            self.__due_frame_id += ((frame_id - self.__due_frame_id) // self.__re_detect_every + 1) \
+                * self.__re_detect_every
+
+
+class AdaptiveScheduler:
+    """
+    Re-detects objects, when tracks are likely to drift: some of them are lost, they change size or speed noticeably
+    since the last detection, or the detection is just too old. Hard limits bound an interval between detections
+    """
+    # A number of frames to estimate a velocity over, so jitter of engines doesn't count as a change
+    _VELOCITY_WINDOW = 3
+
+    def __init__(self, min_interval, max_interval, size_change, velocity_change):
+        """
+        """
+        if not 1 <= min_interval <= max_interval:
+            raise ValueError(f'Re-detection intervals must satisfy 1 <= min <= max, got {min_interval}, {max_interval}')
+
+        self.__min_interval = min_interval
+        self.__max_interval = max_interval
+        self.__size_change = size_change
+        self.__velocity_change = velocity_change
+
+        self.__last_frame_id = None
+        # A reason held back by the min interval, it fires as soon as the interval passes
+        self.__pending_reason = None
+        # Sizes and velocities of tracks since the last detection to compare with
+        self.__reference_per_id = {}
+
+    def __str__(self):
+        return (f'{{'
+                f'"strategy": "adaptive", '
+                f'"min_interval": {self.__min_interval}, '
+                f'"max_interval": {self.__max_interval}, '
+                f'"size_change": {self.__size_change}, '
+                f'"velocity_change": {self.__velocity_change}'
+                f'}}')
+
+    @classmethod
+    def __get_velocity(cls, centers):
+        """
+        Returns an average velocity over the recent frames in pixels per frame, if there is enough history
+        """
+        span = min(cls._VELOCITY_WINDOW, len(centers) - 1)
+        if span < 1:
+            return None
+
+        return (centers[-1] - centers[-1 - span]) / span
+
+    def __drifts(self, track):
+        """
+        Returns a reason, if a track changed its size or speed noticeably since its reference
+        """
+        _, _, w, h = track.get_last_rect()
+        velocity = self.__get_velocity(centers=track.get_centers())
+
+        reference = self.__reference_per_id.get(track.get_id())
+        if reference is None:
+            self.__reference_per_id[track.get_id()] = {'area': w * h, 'velocity': velocity}
+            return None
+
+        if reference['area'] and self.__size_change < abs(w * h / reference['area'] - 1.):
+            return 'size_change'
+
+        if reference['velocity'] is None:
+            reference['velocity'] = velocity
+        elif velocity is not None and self.__velocity_change < np.linalg.norm(velocity - reference['velocity']):
+            return 'velocity_change'
+
+        return None
+
+    def __get_reason(self, frame_id, tracks, failed_ids, stick_out_ids):
+        """
+        """
+        if self.__last_frame_id is None:
+            return 'first_frame'
+        if self.__pending_reason is not None:
+            return self.__pending_reason
+        if failed_ids:
+            return 'extend_failure'
+        if stick_out_ids:
+            return 'left_roi'
+        if self.__max_interval <= frame_id - self.__last_frame_id:
+            return 'max_interval'
+
+        # Check every track, so all of them get their references
+        reasons = [self.__drifts(track=track) for track in tracks]
+        return next((r for r in reasons if r is not None), None)
+
+    def decide(self, frame_id, tracks, failed_ids, stick_out_ids):
+        """
+        Tells whether to re-detect objects at a frame, and why. Nothing is committed till the detection happens,
+        so a detection held back by the caller keeps its reason
+        """
+        # Forget references of deceased tracks
+        live_ids = {track.get_id() for track in tracks}
+        self.__reference_per_id = {t_id: r for t_id, r in self.__reference_per_id.items() if t_id in live_ids}
+
+        reason = self.__get_reason(frame_id=frame_id, tracks=tracks, failed_ids=failed_ids,
+                                   stick_out_ids=stick_out_ids)
+        if reason is None:
+            return False, 'steady'
+
+        if 'first_frame' != reason and frame_id - self.__last_frame_id < self.__min_interval:
+            self.__pending_reason = reason
+            return False, f'min_interval_over_{reason}'
+
+        return True, reason
+
+    def on_detection(self, frame_id):
+        """
+        Commits a detection at a frame, it restarts the intervals and serves any pending reason
+        """
+        self.__last_frame_id = frame_id
+        self.__pending_reason = None
+        # Tracks are compared with their states right after the detection from now on
+        self.__reference_per_id = {}
+
+
+def get_scheduler(settings):
+    """
+    Creates a re-detection scheduler with tracker settings
+    """
+    strategy = settings['scheduler']['strategy']
+    scheduler_per_id = {
+        'periodic': lambda: PeriodicScheduler(re_detect_every=settings['re_detect_every']),
+        'adaptive': lambda: AdaptiveScheduler(
+            **{k: v for k, v in settings['scheduler'].items() if 'strategy' != k})
+    }
+
+    return scheduler_per_id[strategy]()
@@ -1,11 +1,20 @@
+import concurrent.futures
+import functools
 import logging
 import random
+import threading
+import time
 import uuid
 
 import cv2
 
+import _ped_trk.metrics
+import _ped_trk.motion
 import _ped_trk.timer
 import _ped_trk.tracker
+import _ped_trk.trajectory
+from pm_pedestrians_tracker.src import association
+from pm_pedestrians_tracker.src import scheduler
 
 
 class _Track(_ped_trk.tracker.Track, _ped_trk.timer.Timeable):
@@ -19,20 +28,6 @@ class _Track(_ped_trk.tracker.Track, _ped_trk.timer.Timeable):
         """
         return uuid.UUID(int=cls.__STABLE_ID_GENERATOR.getrandbits(128), version=4)
 
-    @staticmethod
-    def __iou(rect_a, rect_b):
-        """
-        """
-        i_l = max(rect_a[0], rect_b[0])
-        i_t = max(rect_a[1], rect_b[1])
-        i_r = min(rect_a[0] + rect_a[2], rect_b[0] + rect_b[2])
-        i_b = min(rect_a[1] + rect_a[3], rect_b[1] + rect_b[3])
-        rect_i = i_l, i_t, i_r - i_l, i_b - i_t
-
-        area = lambda r: r[2] * r[3]
-        iou = area(rect_i) / float(area(rect_a) + area(rect_b) - area(rect_i))
-        return iou
-
     @staticmethod
     def center(rect):
         """
@@ -41,42 +36,65 @@ class _Track(_ped_trk.tracker.Track, _ped_trk.timer.Timeable):
         return l + w // 2, t + h // 2
 
     @_ped_trk.timer.timer(label='trk_creation')
-    def __init__(self, logger, engine, frame, seed_detection):
+    def __init__(self, logger, engine, frame, seed_detection, max_history, scale=1.):
         """
+        Seeds a track at a frame downscaled with a scale, the track is extended at frames of the same scale only
         """
         super().__init__(logger=logger)
 
+        self.__scale = scale
         self.__engine = engine
-        self.__engine.init(image=frame, boundingBox=seed_detection['lt_wh'])
-        self.__points = [seed_detection['lt_wh'], ]
+        self.__engine.init(image=frame, boundingBox=tuple(int(round(v * scale)) for v in seed_detection['lt_wh']))
+        self.__trajectory = _ped_trk.trajectory.Trajectory(max_len=max_history, rect=seed_detection['lt_wh'])
+        self.__score = float(seed_detection['score'])
         self.__id = self.__get_unique_stable_id()
+        self.__update_elapsed_ns = 0
+
+        # Keep the last natively tracked position with a velocity of the left-top corner to predict positions
+        self.__tracked_rect = tuple(seed_detection['lt_wh'])
+        self.__velocity = 0., 0.
+        self.__frames_since_tracked = 0
 
     @_ped_trk.timer.timer(label='trk_update')
     def extend(self, frame):
         """
+        Extends the track natively, it's safe to extend distinct tracks concurrently
         """
+        start = time.perf_counter_ns()
         tracked, box = self.__engine.update(image=frame)
+        self.__update_elapsed_ns = time.perf_counter_ns() - start
         if tracked:
-            self.__points.append(box)
+            # Map the box back to the full resolution
+            if 1 != self.__scale:
+                box = tuple(v / self.__scale for v in box)
+            steps = self.__frames_since_tracked + 1
+            self.__velocity = tuple((n - o) / steps for n, o in zip(box[:2], self.__tracked_rect[:2]))
+            self.__tracked_rect = tuple(box)
+            self.__frames_since_tracked = 0
+            self.__trajectory.append(rect=box)
 
         return tracked
 
-    @_ped_trk.timer.timer(label='trk_det_association')
-    def select_best_match(self, iou_threshold, detections):
+    def predict(self):
         """
+        Extends the track with a constant velocity since the last natively tracked position
         """
-        best_iou, best_i = None, None
-
-        last_point = self.__points[-1]
-        for i, d in enumerate(detections):
-            iou = self.__iou(rect_a=d['lt_wh'], rect_b=last_point)
-            if iou < iou_threshold:
-                continue
+        self.__frames_since_tracked += 1
+        l, t, w, h = self.__tracked_rect
+        v_x, v_y = self.__velocity
+        self.__trajectory.append(rect=(l + v_x * self.__frames_since_tracked, t + v_y * self.__frames_since_tracked, w, h))
 
-            if best_iou is None or best_iou < iou:
-                best_iou, best_i = iou, i
+    def get_scale(self):
+        """
+        Returns a scale of frames the track is extended at
+        """
+        return self.__scale
 
-        return best_i
+    def get_update_elapsed_ns(self):
+        """
+        Returns how long the last native extension of the track took
+        """
+        return self.__update_elapsed_ns
 
     def get_id(self):
         """
@@ -85,19 +103,29 @@ class _Track(_ped_trk.tracker.Track, _ped_trk.timer.Timeable):
 
     def get_centers(self):
         """
+        Returns a read-only view of the recent centers, from the oldest to the newest one
         """
-        cs = [(l + w // 2, t + h // 2) for (l, t, w, h) in self.__points]
-        return cs
+        return self.__trajectory.get_centers()
 
     def get_last_rect(self):
         """
         """
-        return self.__points[-1]
+        return self.__trajectory.get_last_rect()
+
+    def get_score(self):
+        """
+        """
+        return self.__score
 
     def get_last_center(self):
         """
         """
-        return self.get_centers()[-1]
+        return self.__trajectory.get_last_center()
+
+    def is_interpolated(self):
+        """
+        """
+        return 0 < self.__frames_since_tracked
 
 
 class Tracker(_ped_trk.tracker.Tracker, _ped_trk.timer.Timeable):
@@ -132,18 +160,74 @@ class Tracker(_ped_trk.tracker.Tracker, _ped_trk.timer.Timeable):
 
         self.__tracking_engine_creator = self.__get_tracking_engine_creator(strategy=settings['strategy'])
         self.__iou_threshold = settings['iou_threshold']
-        self.__re_detect_every = settings['re_detect_every']
+        self.__associator = association.get_associator(strategy=settings['association'])
+        self.__scheduler = scheduler.get_scheduler(settings=settings)
+        # Engines release the GIL while updating, so threads are enough to extend tracks in parallel
+        self.__extend_workers = settings['extend_workers']
+        self.__extend_pool = None
+        if 1 < self.__extend_workers:
+            self.__extend_pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.__extend_workers,
+                                                                       thread_name_prefix='TrackExtender')
         self.__roi = roi
+        self.__max_history = settings['max_history']
+        # Engines run at downscaled frames, a track picks the coarsest level keeping its box not less than the minimum
+        self.__pyramid_levels = sorted(settings['pyramid']['levels'], reverse=True)
+        if not all(0 < s <= 1 for s in self.__pyramid_levels):
+            raise ValueError(f'Pyramid levels must be within (0, 1], got {self.__pyramid_levels}')
+        self.__min_box_side = settings['pyramid']['min_box_side']
+        self.__pyramid_base = None
+        self.__frame_per_level = {}
+        # Engines and the detector run at every stride-th frame only
+        self.__stride = settings['stride']
+        if self.__stride < 1:
+            raise ValueError(f'Tracking stride must be positive, got {self.__stride}')
+        self.__motion_gate = _ped_trk.motion.create_motion_gate(logger=logger, settings=settings['motion'])
+        # Detection is limited to moved regions by the ROI passed to the detector, so it takes a detector cropping to it
+        self.__limit_detection = settings['motion']['limit_detection']
+        # Detect objects at a worker, while tracks keep extending, detections are applied once they arrive
+        self.__detection_pool = None
+        # Frames shared with a pending detection are held till new tracks catch up through them, older ones beyond
+        # the limit are dropped, and tracks are predicted at them instead
+        self.__max_shared_frames = settings['max_shared_frames']
+        if self.__max_shared_frames < 1:
+            raise ValueError(f'A number of shared frames must be positive, got {self.__max_shared_frames}')
+        if settings['pipelined']:
+            self.__detection_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1,
+                                                                          thread_name_prefix='Detector')
+        self.__pending_detection = None
         self.get_logger().info(f'Establish a tracker: {{'
                                f'"strategy": {settings["strategy"]}, '
                                f'"iou_threshold": {self.__iou_threshold}, '
-                               f'"re_detect_every": {self.__re_detect_every}, '
+                               f'"association": {settings["association"]}, '
+                               f'"scheduler": {self.__scheduler}, '
+                               f'"extend_workers": {self.__extend_workers}, '
+                               f'"max_history": {self.__max_history}, '
+                               f'"stride": {self.__stride}, '
+                               f'"pyramid_levels": {self.__pyramid_levels}, '
+                               f'"min_box_side": {self.__min_box_side}, '
+                               f'"motion_gating": {str(self.__motion_gate is not None).lower()}, '
+                               f'"pipelined": {str(self.__detection_pool is not None).lower()}, '
+                               f'"max_shared_frames": {self.__max_shared_frames}, '
                                f'"roi": {self.__roi}'
                                f'}}')
 
         self.__frames_seen = 0
         self.__tracks = {}
 
+    def __del__(self):
+        if self.__extend_pool is not None:
+            self.__extend_pool.shutdown(wait=False)
+        if self.__detection_pool is not None:
+            self.__detection_pool.shutdown(wait=False)
+
+    def close(self):
+        """
+        Waits for detection in flight, so the detector isn't used once tracking is over
+        """
+        if self.__detection_pool is not None:
+            self.__detection_pool.shutdown(wait=True)
+        self.__pending_detection = None
+
     def __add_track(self, track):
         """
         """
@@ -171,9 +255,76 @@ class Tracker(_ped_trk.tracker.Tracker, _ped_trk.timer.Timeable):
         """
         return sorted(self.__tracks.keys())
 
+    def __get_level(self, rect):
+        """
+        Picks the coarsest pyramid level, which keeps the smaller side of a box not less than the minimum
+        """
+        side = min(rect[2], rect[3])
+        return min((s for s in self.__pyramid_levels if self.__min_box_side <= side * s),
+                   default=self.__pyramid_levels[0])
+
+    @staticmethod
+    def __downscale(frame, level):
+        """
+        """
+        return frame if 1 == level else cv2.resize(src=frame, dsize=None, fx=level, fy=level,
+                                                   interpolation=cv2.INTER_AREA)
+
+    @_ped_trk.timer.timer(label='trk_pyramid')
+    def __build_pyramid(self, frame, levels):
+        """
+        Downscales a frame once per level, so all the tracks of the level share it
+        """
+        if self.__pyramid_base is not frame:
+            self.__pyramid_base, self.__frame_per_level = frame, {}
+
+        for level in set(levels) - self.__frame_per_level.keys():
+            self.__frame_per_level[level] = self.__downscale(frame=frame, level=level)
+
+    @_ped_trk.timer.timer(label='trk_prediction')
+    def __predict(self):
+        """
+        Predicts positions of all tracks at a frame in between strided ones
+        """
+        [track.predict() for track in self.__tracks.values()]
+
+    @_ped_trk.timer.timer(label='trk_extension')
+    def __extend(self, t_ids, frame):
+        """
+        Extends tracks natively, possibly in parallel, returns the outcomes in the order of the ids
+        """
+        tracks = [self.__get_track(t_id=t_id) for t_id in t_ids]
+        self.__build_pyramid(frame=frame, levels={track.get_scale() for track in tracks})
+        extend = lambda track: track.extend(frame=self.__frame_per_level[track.get_scale()])
+        if self.__extend_pool is None:
+            tracked_per_track = [extend(track) for track in tracks]
+        else:
+            # Collect results in the submission order, so completion order doesn't matter
+            tracked_per_track = list(self.__extend_pool.map(extend, tracks))
+
+        self.get_logger().debug(f'Report timing for track extensions: {{'
+                                f'"frame_id": {self.__frames_seen}, '
+                                f'"elapsed_ms_per_id": {{'
+                                + ', '.join(f'"{t.get_id()}": {t.get_update_elapsed_ns() / 1e6:.3f}' for t in tracks)
+                                + f'}}'
+                                f'}}')
+
+        return tracked_per_track
+
+    @_ped_trk.timer.timer(label='trk_det_association')
+    def __associate(self, t_rects, detections):
+        """
+        Pairs rects of tracks with detections of a frame globally, returns indices of matched tracks and detections
+        """
+        d_rects = [d['lt_wh'] for d in detections]
+        ious = association.iou_matrix(rects_a=t_rects, rects_b=d_rects)
+
+        return self.__associator(ious=ious, iou_threshold=self.__iou_threshold)
+
     @_ped_trk.timer.timer(label='frame_handling')
-    def track(self, frame):
+    def track(self, frame, detections=None):
         """
+        Tracks objects at a frame, detections of the frame might be provided, if they are known in advance
         """
         self.__frames_seen += 1
         self.get_logger().debug(f'Track objects: {{'
@@ -185,11 +336,28 @@ class Tracker(_ped_trk.tracker.Tracker, _ped_trk.timer.Timeable):
             self.__roi = 0, 0, frame.shape[1] - 1, frame.shape[0] - 1
             self.get_logger().info(f'Settle the ROI: {{"ltwh": {self.__roi}}}')
 
+        # Fill frames in between strided ones with predicted positions
+        if 0 != (self.__frames_seen - 1) % self.__stride:
+            self.__predict()
+            self.__share_frame(frame=None)
+            return [], []
+
+        # Skip frozen frames, e.g. repeated by a stalled stream, there is nothing new to track at them. Positions are
+        # predicted at them still, so every frame has ones, and velocities count the time passed
+        if self.__motion_gate is not None and self.__motion_gate.update(frame=frame):
+            self.get_logger().debug(f'Skip a frozen frame: {{'
+                                    f'"frame_id": {self.__frames_seen}'
+                                    f'}}')
+            _ped_trk.metrics.get_registry().increment(label='frozen_frames')
+            self.__predict()
+            self.__share_frame(frame=None)
+            return [], []
+
         failed_to_extend_ids, stick_out_roi_ids = [], []
-        for t_id in self.__get_track_ids():
+        t_ids = self.__get_track_ids()
+        for t_id, tracked in zip(t_ids, self.__extend(t_ids=t_ids, frame=frame)):
             track = self.__get_track(t_id=t_id)
 
-            tracked = track.extend(frame=frame)
             if not tracked:
                 # Identify tracks that couldn't be extended natively
                 failed_to_extend_ids.append(track.get_id())
@@ -197,16 +365,89 @@ class Tracker(_ped_trk.tracker.Tracker, _ped_trk.timer.Timeable):
                 # Identify tracks that stick out of the ROI
                 stick_out_roi_ids.append(track.get_id())
 
-        # Wrap up, if there are some tracks, they were extended natively, it's not the time to look for extra objects
-        all_tracks_were_extended = not bool(failed_to_extend_ids + stick_out_roi_ids)
-        force_re_detection = 0 == self.__frames_seen % self.__re_detect_every
-        if all_tracks_were_extended and not force_re_detection:
+        if self.__detection_pool is not None and detections is None:
+            return self.__track_pipelined(frame=frame, failed_to_extend_ids=failed_to_extend_ids,
+                                          stick_out_roi_ids=stick_out_roi_ids)
+
+        re_detect, motion_regions = self.__schedule(failed_to_extend_ids=failed_to_extend_ids,
+                                                    stick_out_roi_ids=stick_out_roi_ids)
+
+        # Wrap up, if tracks were extended natively, and it's not the time to look for extra objects
+        if not failed_to_extend_ids and not stick_out_roi_ids and not re_detect:
             self.get_logger().debug(f'Extend all tracks successfully: {{'
                                     f'"frame_id": {self.__frames_seen}, '
                                     f'"ids": {self.__get_track_ids()}'
                                     f'}}')
             return [], []
 
+        self.__dismiss_lost_tracks(failed_to_extend_ids=failed_to_extend_ids, stick_out_roi_ids=stick_out_roi_ids)
+
+        # Wrap up with lost tracks, if re-detection is held back
+        if not re_detect:
+            return failed_to_extend_ids + stick_out_roi_ids, []
+
+        self.get_logger().debug(f'Maintain tracks before re-detection: {{'
+                                f'"frame_id": {self.__frames_seen}, '
+                                f'"ids": {self.__get_track_ids()}'
+                                f'}}')
+
+        # Re-detect all the legit objects
+        if detections is None:
+            detections = self.__detector.detect(frame=frame, roi=self.__get_detection_roi(motion_regions=motion_regions))
+        if self.__motion_gate is not None:
+            self.__motion_gate.clear()
+
+        t_ids = self.__get_track_ids()
+        phantom_ids, detections = self.__match(
+            detections=detections, t_ids=t_ids, t_rects=[self.__get_track(t_id=t_id).get_last_rect() for t_id in t_ids])
+        self.__dismiss_phantom_tracks(phantom_ids=phantom_ids)
+
+        # Establish tracks for unbound detections of the frame
+        tracks = []
+        levels = [self.__get_level(rect=d['lt_wh']) for d in detections]
+        self.__build_pyramid(frame=frame, levels=levels)
+        for d, level in zip(detections, levels):
+            track = self.__create_track(frame=self.__frame_per_level[level], detection=d, level=level)
+            if track is not None:
+                tracks.append(track)
+        est_ids = self.__establish_tracks(tracks=tracks)
+
+        return failed_to_extend_ids + stick_out_roi_ids + phantom_ids, est_ids
+
+    def __schedule(self, failed_to_extend_ids, stick_out_roi_ids):
+        """
+        Decides whether it's the time to look for objects, returns the decision with regions moved since the last one
+        """
+        # Tracks that are lost don't count
+        lost_ids = set(failed_to_extend_ids + stick_out_roi_ids)
+        re_detect, reason = self.__scheduler.decide(
+            frame_id=self.__frames_seen, tracks=[t for t in self.get_tracks() if t.get_id() not in lost_ids],
+            failed_ids=failed_to_extend_ids, stick_out_ids=stick_out_roi_ids)
+
+        # Hold re-detection back, unless anything moved at the ROI since the last detection, or some tracks are lost.
+        # The scheduler isn't told about a held back detection, so it asks for one again at the next frame
+        motion_regions = None
+        if re_detect and self.__motion_gate is not None:
+            motion_regions = self.__motion_gate.get_regions(roi=self.__roi)
+            if not motion_regions and not lost_ids:
+                re_detect, reason = False, 'no_motion'
+        if re_detect:
+            self.__scheduler.on_detection(frame_id=self.__frames_seen)
+
+        self.get_logger().debug(f'Schedule re-detection: {{'
+                                f'"frame_id": {self.__frames_seen}, '
+                                f'"re_detect": {str(re_detect).lower()}, '
+                                f'"reason": "{reason}"'
+                                f'}}')
+        registry = _ped_trk.metrics.get_registry()
+        registry.increment(label='re_detections' if re_detect else 're_detections_skipped')
+        registry.increment(label=f're_detection_reason_{reason}')
+
+        return re_detect, motion_regions
+
+    def __dismiss_lost_tracks(self, failed_to_extend_ids, stick_out_roi_ids):
+        """
+        """
         # Dismiss tracks that failed to extend
         self.get_logger().log(level=logging.INFO if failed_to_extend_ids else logging.DEBUG,
                               msg=f'Dismiss tracks failed to extend: {{'
@@ -223,32 +464,208 @@ class Tracker(_ped_trk.tracker.Tracker, _ped_trk.timer.Timeable):
                                   f'}}')
         self.__dismiss_tracks(t_ids=stick_out_roi_ids)
 
-        self.get_logger().debug(f'Maintain tracks before re-detection: {{'
-                                f'"frame_id": {self.__frames_seen}, '
-                                f'"ids": {self.__get_track_ids()}'
-                                f'}}')
+    def __get_detection_roi(self, motion_regions):
+        """
+        """
+        if self.__limit_detection and motion_regions:
+            # Look for objects only where anything moved or is tracked
+            return _ped_trk.motion.bound(rects=motion_regions + [t.get_last_rect() for t in self.get_tracks()],
+                                         roi=self.__roi)
 
-        # Re-detect all the legit objects
-        detections = [d for d in self.__detector.detect(frame=frame)
+        return self.__roi
+
+    def __track_pipelined(self, frame, failed_to_extend_ids, stick_out_roi_ids):
+        """
+        Detects objects at the worker, while tracks keep extending, so no frame waits for the detector.
+        Detections are applied at the first frame they are ready at, no other detection starts till then
+        """
+        lost_ids = failed_to_extend_ids + stick_out_roi_ids
+        if lost_ids:
+            self.__dismiss_lost_tracks(failed_to_extend_ids=failed_to_extend_ids,
+                                       stick_out_roi_ids=stick_out_roi_ids)
+
+        pending = self.__pending_detection
+        if pending is not None:
+            self.__share_frame(frame=frame)
+            if not pending['future'].done():
+                return lost_ids, []
+
+            self.__pending_detection = None
+            phantom_ids, tracks, caught_up_num = pending['future'].result()
+            # Catch up with frames shared after the worker was done
+            for frame_per_level in pending['frames'][caught_up_num:]:
+                tracks = self.__catch_up(tracks=tracks, frame_per_level=frame_per_level)
+            lag = self.__frames_seen - pending['frame_id']
+            registry = _ped_trk.metrics.get_registry()
+            registry.increment(label='detection_lag_frames', num=lag)
+            registry.increment(label='shared_frame_bytes', num=-pending['held_bytes'])
+            self.get_logger().debug(f'Receive detections of an earlier frame: {{'
+                                    f'"frame_id": {self.__frames_seen}, '
+                                    f'"detected_frame_id": {pending["frame_id"]}, '
+                                    f'"lag": {lag}, '
+                                    f'"dropped_frames_num": {pending["dropped_num"]}, '
+                                    f'"held_bytes_peak": {pending["held_bytes_peak"]}'
+                                    f'}}')
+
+            # Tracks lost since the detected frame are gone already
+            phantom_ids = [t_id for t_id in phantom_ids if t_id in self.__tracks]
+            self.__dismiss_phantom_tracks(phantom_ids=phantom_ids)
+            est_ids = self.__establish_tracks(tracks=tracks)
+            return lost_ids + phantom_ids, est_ids
+
+        re_detect, motion_regions = self.__schedule(failed_to_extend_ids=failed_to_extend_ids,
+                                                    stick_out_roi_ids=stick_out_roi_ids)
+        if re_detect:
+            frame = frame.copy()
+            # Bind the detection to the frame now, detectors may depend on a state set per frame, e.g. its id
+            defer = getattr(self.__detector, 'defer', None)
+            detect = functools.partial(self.__detector.detect, frame=frame) if defer is None else defer(frame=frame)
+            pending = {
+                'frame_id': self.__frames_seen,
+                # Match detections with tracks as they are at the detected frame
+                'rect_per_id': {t.get_id(): t.get_last_rect() for t in self.get_tracks()},
+                # Every frame since the detected one as its downscales per pyramid level, built once for all the
+                # tracks, or None, if tracks are predicted at it
+                'frames': [{1.: frame}, ],
+                # A number of the frames new tracks are extended through at the worker, which are released already
+                'caught_up_num': 0,
+                'dropped_num': 0,
+                'held_bytes': 0,
+                'held_bytes_peak': 0,
+                'lock': threading.Lock()
+            }
+            pending['future'] = self.__detection_pool.submit(
+                self.__detect_pipelined, detect=detect, roi=self.__get_detection_roi(motion_regions=motion_regions),
+                pending=pending)
+            self.__pending_detection = pending
+            if self.__motion_gate is not None:
+                self.__motion_gate.clear()
+
+        return lost_ids, []
+
+    def __detect_pipelined(self, detect, roi, pending):
+        """
+        Runs at the worker: detects objects at the pending frame, matches them with tracks as they were at the frame,
+        and seeds tracks of unmatched detections, which catch up with frames shared meanwhile.
+        Returns ids of phantom tracks, new tracks and a number of frames they are extended through
+        """
+        detections = detect(roi=roi)
+        t_ids = list(pending['rect_per_id'])
+        phantom_ids, detections = self.__match(detections=detections, t_ids=t_ids,
+                                               t_rects=[pending['rect_per_id'][t_id] for t_id in t_ids])
+
+        [frame_per_level, ] = pending['frames'][:1]
+        tracks = []
+        for d in detections:
+            level = self.__get_level(rect=d['lt_wh'])
+            track = self.__create_track(frame=self.__get_shared_frame(frame_per_level=frame_per_level, level=level),
+                                        detection=d, level=level)
+            if track is not None:
+                tracks.append(track)
+        self.__release_shared_frames(pending=pending, caught_up_num=1)
+
+        # Tracks of new objects fall behind the others, till they are extended through all the frames shared so far.
+        # Frames keep coming meanwhile, so the worker stops, once it doesn't gain on them, and the tracker extends
+        # the tracks through the rest
+        caught_up_num, behind_num = 1, None
+        while tracks:
+            with pending['lock']:
+                frames = pending['frames'][caught_up_num:]
+            if not frames or behind_num is not None and behind_num <= len(frames):
+                break
+            behind_num = len(frames)
+            for frame_per_level in frames:
+                tracks = self.__catch_up(tracks=tracks, frame_per_level=frame_per_level)
+            caught_up_num += len(frames)
+            self.__release_shared_frames(pending=pending, caught_up_num=caught_up_num)
+
+        return phantom_ids, tracks, caught_up_num
+
+    @staticmethod
+    def __release_shared_frames(pending, caught_up_num):
+        """
+        Lets frames of a pending detection go, once new tracks are extended through them
+        """
+        with pending['lock']:
+            frames = pending['frames']
+            for i in range(pending['caught_up_num'], caught_up_num):
+                frames[i] = None
+            pending['caught_up_num'] = caught_up_num
+
+    def __share_frame(self, frame):
+        """
+        Shares a frame with a pending detection, so tracks of new objects catch up with the others through it.
+        Frames are copied, since they are annotated in place once tracked, None stands for a frame to predict at
+        """
+        pending = self.__pending_detection
+        if pending is None:
+            return
+
+        registry = _ped_trk.metrics.get_registry()
+        with pending['lock']:
+            frames = pending['frames']
+            frames.append(None if frame is None else {1.: frame.copy()})
+
+            # Drop the oldest frames new tracks aren't extended through yet, beyond the limit, but the detected one
+            held_ids = [i for i in range(max(1, pending['caught_up_num']), len(frames)) if frames[i] is not None]
+            for i in held_ids[:max(0, len(held_ids) - self.__max_shared_frames)]:
+                frames[i] = None
+                pending['dropped_num'] += 1
+                registry.increment(label='shared_frames_dropped')
+
+            # Keep the counter of held bytes current, so periodic dumps tell the memory pending detections hold
+            held_bytes = sum(image.nbytes for frame_per_level in frames if frame_per_level is not None
+                             for image in frame_per_level.values())
+        registry.increment(label='shared_frame_bytes', num=held_bytes - pending['held_bytes'])
+        pending['held_bytes'] = held_bytes
+        pending['held_bytes_peak'] = max(pending['held_bytes_peak'], held_bytes)
+
+    def __get_shared_frame(self, frame_per_level, level):
+        """
+        Downscales a shared frame to a pyramid level once, so all the tracks of the level share it
+        """
+        if level not in frame_per_level:
+            frame_per_level[level] = self.__downscale(frame=frame_per_level[1.], level=level)
+
+        return frame_per_level[level]
+
+    def __catch_up(self, tracks, frame_per_level):
+        """
+        Extends tracks through a shared frame, or predicts them at a frame in between, returns the ones still tracked
+        """
+        if frame_per_level is None:
+            [track.predict() for track in tracks]
+            return tracks
+
+        return [t for t in tracks
+                if t.extend(frame=self.__get_shared_frame(frame_per_level=frame_per_level, level=t.get_scale()))]
+
+    def __match(self, detections, t_ids, t_rects):
+        """
+        Pairs tracks with detections of a frame at the ROI, returns ids of unmatched tracks and unmatched detections
+        """
+        detections = [d for d in detections
                       if self.__within(rect=self.__roi, center=_Track.center(rect=d['lt_wh']))]
         self.get_logger().debug(f'Detect objects of a frame: {{'
                                 f'"frame_id": {self.__frames_seen}, '
                                 f'"data": {detections}'
                                 f'}}')
 
-        phantom_ids = []
-        for t_id in self.__get_track_ids():
-            track = self.__get_track(t_id=t_id)
+        matches = self.__associate(t_rects=t_rects, detections=detections)
+        matched_t_inds = {t_ind for t_ind, _ in matches}
+        matched_d_inds = {d_ind for _, d_ind in matches}
 
-            # Identify tracks that fail to match detections of the frame
-            d_ind = track.select_best_match(iou_threshold=self.__iou_threshold, detections=detections)
-            if d_ind is None:
-                phantom_ids.append(t_id)
-                continue
+        # Identify tracks that fail to match detections of the frame
+        phantom_ids = [t_id for t_ind, t_id in enumerate(t_ids) if t_ind not in matched_t_inds]
 
-            # Identify trackless detections
-            detections = detections[:d_ind] + detections[d_ind + 1:]
+        # Identify trackless detections
+        detections = [d for d_ind, d in enumerate(detections) if d_ind not in matched_d_inds]
 
+        return phantom_ids, detections
+
+    def __dismiss_phantom_tracks(self, phantom_ids):
+        """
+        """
         # Dismiss tracks failed to match detection of the frame
         self.get_logger().log(level=logging.INFO if phantom_ids else logging.DEBUG,
                               msg=f'Dismiss phantom tracks: {{'
@@ -262,25 +679,30 @@ class Tracker(_ped_trk.tracker.Tracker, _ped_trk.timer.Timeable):
                                 f'"ids": {[t.get_id() for t in self.get_tracks()]}'
                                 f'}}')
 
-        # Establish tracks for unbound detections of the frame
-        est_ids = []
-        for d in detections:
-            try:
-                track = _Track(logger=self.get_logger(), engine=self.__tracking_engine_creator(), frame=frame,
-                               seed_detection=d)
-            except Exception as e:
-                self.__logger.error(f'{e}')
-            else:
-                self.__add_track(track=track)
-                est_ids.append(track.get_id())
+    def __create_track(self, frame, detection, level):
+        """
+        Seeds a track at a frame downscaled to a pyramid level, returns None if the engine fails
+        """
+        try:
+            return _Track(logger=self.get_logger(), engine=self.__tracking_engine_creator(), frame=frame,
+                          seed_detection=detection, max_history=self.__max_history, scale=level)
+        except Exception as e:
+            self.get_logger().error(f'{e}')
+
+        return None
 
+    def __establish_tracks(self, tracks):
+        """
+        """
+        [self.__add_track(track=track) for track in tracks]
+        est_ids = [track.get_id() for track in tracks]
         self.get_logger().log(level=logging.INFO if est_ids else logging.DEBUG,
                               msg=f'Establish some tracks: {{'
                                   f'"frame_id": {self.__frames_seen}, '
                                   f'"ids": {est_ids}'
                                   f'}}')
 
-        return failed_to_extend_ids + stick_out_roi_ids + phantom_ids, est_ids
+        return est_ids
 
     def get_tracks(self):
         """
@@ -291,3 +713,8 @@ class Tracker(_ped_trk.tracker.Tracker, _ped_trk.timer.Timeable):
         """
         """
         return self.__roi
+
+    def get_max_history(self):
+        """
+        """
+        return self.__max_history